@@ -7,28 +7,39 @@
 # =============================================================================
 
 import asyncio
-import html
+import functools
+import hashlib
 import json
 import logging
 import os
 import random
+import re
 import secrets
 import signal
 import time
+import weakref
 from asyncio import Lock, Queue, Semaphore
 from collections import defaultdict
-from typing import Optional
+from typing import Callable, Optional
 
 import aiohttp
 import asyncpg
+import ijson
+import orjson
 from dotenv import load_dotenv
+from eth_account import Account
 from eth_account.messages import encode_defunct
 from telebot import types
 from telebot.async_telebot import AsyncTeleBot
 from web3 import Web3
 
+try:
+    import uvloop  # libuv-цикл событий; под Windows недоступен
+except ImportError:
+    uvloop = None
+
 # NFA импорт (относительный, так как bot.py в папке src)
-from nfa import mint_guardian, update_guardian_learning, attest_protection, contract
+from nfa import mint_guardian, update_guardian_learning, attest_protection, get_contract, NFA_ADDRESS, shutdown_mint_executor, sign_raw_transaction, fetch_tx_params, get_smart_w3, probe_w3
 
 # ---------------------------------------------------------------------------
 # КОНФИГУРАЦИЯ
@@ -84,29 +95,47 @@ ALL_RPC_URLS = HTTP_URLS + FALLBACK_RPCS
 # УМНОЕ ПОДКЛЮЧЕНИЕ К БЛОКЧЕЙНУ
 # ---------------------------------------------------------------------------
 
-def get_smart_w3(url_string):
-    """Умное подключение к блокчейну с автоматическим переключением"""
+# probe_w3/get_smart_w3 живут в nfa — одна реализация на оба модуля
+
+CHAIN_W3_TTL = 300  # раз в 5 минут заново выбираем самый быстрый узел
+
+async def get_smart_w3_async(url_string: str) -> Web3:
+    """То же, что get_smart_w3, но без блокировки цикла событий: проверки идут в потоках"""
     urls = [u.strip() for u in url_string.split(",") if u.strip()]
-    # Пробуем подключиться по очереди, пока не найдем живой узел
-    for url in urls:
-        try:
-            if url.startswith('http'):
-                provider = Web3.HTTPProvider(url, request_kwargs={'timeout': 3})
-            elif url.startswith('ws'):
-                provider = Web3.WebsocketProvider(url)
-            else:
-                continue
-                
-            temp_w3 = Web3(provider)
-            if temp_w3.is_connected():
-                logger.info(f"✅ Успешное подключение к блокчейну через: {url}")
+    probes = [asyncio.create_task(asyncio.to_thread(probe_w3, url)) for url in urls]
+    try:
+        for fut in asyncio.as_completed(probes):
+            temp_w3 = await fut
+            if temp_w3 is not None:
+                logger.info(f"✅ Успешное подключение к блокчейну через: {temp_w3.provider.endpoint_uri}")
                 return temp_w3
-        except Exception as e:
-            logger.warning(f"⚠️ Узел {url} недоступен, пробую следующий... Ошибка: {e}")
-            continue
+    finally:
+        for t in probes:
+            t.cancel()  # сами потоки доработают, их результат просто не нужен
     raise Exception("❌ КРИТИЧЕСКАЯ ОШИБКА: Ни один из RPC-узлов не отвечает!")
 
 
+_chain_w3: Optional[Web3] = None
+_chain_w3_ts: float = 0.0
+_chain_w3_lock = Lock()
+
+
+async def get_chain_w3() -> Web3:
+    """Один общий Web3 для операций, которым нужна сеть (создаётся при первом вызове)"""
+    global _chain_w3, _chain_w3_ts
+    async with _chain_w3_lock:  # параллельные вызовы не запускают опрос узлов дважды
+        if _chain_w3 is None or time.time() - _chain_w3_ts > CHAIN_W3_TTL:
+            _chain_w3 = await get_smart_w3_async(_RAW_HTTP_URL)
+            _chain_w3_ts = time.time()
+        return _chain_w3
+
+
+def reset_chain_w3() -> None:
+    """Сбросить общий Web3 — следующий вызов заново выберет живой узел"""
+    global _chain_w3
+    _chain_w3 = None
+
+
 # Опциональные
 GEMINI_KEYS = [k for k in _optional("GEMINI_API_KEY").split(",") if k.strip()]
 GROQ_KEYS   = [k for k in _optional("GROQ_API_KEY").split(",") if k.strip()]
@@ -142,6 +171,8 @@ ERC20_TRANSFER_TOPIC = (
     "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
 )
 
+MAX_UINT256 = 2**256 - 1  # "бесконечный" approve
+
 bot = AsyncTeleBot(TELEGRAM_TOKEN, parse_mode="HTML")
 
 if not any([XAI_KEYS, GROQ_KEYS, GEMINI_KEYS, DEEPSEEK_KEYS]):
@@ -154,21 +185,30 @@ if not WEBAPP_URL:
 # СТРУКТУРА БД
 # ---------------------------------------------------------------------------
 
-_DB_DEFAULT: dict = {
-    "stats": {"blocks": 0, "whales": 0, "threats": 0},
-    "cfg":   {"limit_usd": 10_000.0, "watch": [], "ignore": []},
-    "user_limits": {}, # <-- Добавили хранилище персональных лимитов
-    "user_guardians": {},   # <-- добавить сюда
-    "guardian_stats_cache": {},  # <-- кеш статистики Guardian NFT
-    "bonus_flags": {},  # <-- сюда будем записывать, какие бонусы получил пользователь
-    "total_analyzed_usd": 0.0,          # <-- добавить эту строку
-    "last_block": 0,
-    "connected_wallets": {},
-    "pending_verifications": {},
-}
+def _make_default_db() -> dict:
+    """Свежая БД по умолчанию: вложенные dict/list не разделяются между копиями"""
+    return {
+        "stats": {"blocks": 0, "whales": 0, "threats": 0},
+        "cfg":   {"limit_usd": 10_000.0, "watch": [], "ignore": []},
+        "user_limits": {}, # <-- Добавили хранилище персональных лимитов
+        "user_guardians": {},   # <-- добавить сюда
+        "guardian_stats_cache": {},  # <-- кеш статистики Guardian NFT
+        "bonus_flags": {},  # <-- сюда будем записывать, какие бонусы получил пользователь
+        "total_analyzed_usd": 0.0,          # <-- добавить эту строку
+        "last_block": 0,
+        "connected_wallets": {},
+        "pending_verifications": {},
+        "nonce_index": {},  # <-- nonce -> uid для O(1) поиска сессии в /webapp/connect
+        "audit_cache_by_hash": {},  # <-- результаты аудита по хешу исходного кода
+    }
 
 db: dict = {}
 
+# Разделы db, которые хранятся построчно в таблице user_rows (а не в блобе bot_data)
+_ROW_SECTIONS = ("user_limits", "connected_wallets", "pending_verifications")
+# Не пишем в блоб: построчные разделы и то, что восстанавливается при загрузке
+_BLOB_EXCLUDE = frozenset(_ROW_SECTIONS) | {"nonce_index"}
+
 # ---------------------------------------------------------------------------
 # ГЛОБАЛЬНЫЕ ОБЪЕКТЫ
 # ---------------------------------------------------------------------------
@@ -177,33 +217,83 @@ pool: Optional[asyncpg.Pool] = None
 http_session: Optional[aiohttp.ClientSession] = None
 start_time = time.time()
 
-rpc_sem  = Semaphore(10)
+# Отдельный лимит параллельных RPC на каждый узел: медленный узел не душит остальные.
+# Свои узлы из OPBNB_HTTP_URL держат больше, публичные fallback — меньше (rate limit)
+RPC_CONCURRENCY_OWN = 20
+RPC_CONCURRENCY_PUBLIC = 5
+_rpc_sems: dict[str, Semaphore] = {
+    url: Semaphore(RPC_CONCURRENCY_OWN if url in HTTP_URLS else RPC_CONCURRENCY_PUBLIC)
+    for url in ALL_RPC_URLS
+}
 ai_sem   = Semaphore(3)
 tg_sem   = Semaphore(20)
-db_lock  = Lock()
-price_lock = Lock()
+db_lock  = Lock()  # общий блоб db и снимок в save_db
+
+# Разделы из _ROW_SECTIONS правим под замком конкретного пользователя —
+# разные пользователи не ждут друг друга. Замок живёт, пока кто-то его держит.
+_user_locks: "weakref.WeakValueDictionary[str, Lock]" = weakref.WeakValueDictionary()
+
+
+def user_lock(uid) -> Lock:
+    key = str(uid)
+    lock = _user_locks.get(key)
+    if lock is None:
+        lock = _user_locks[key] = Lock()
+    return lock
+
+# Отложенное сохранение БД: изменения только ставят флаг, пишет _db_flusher
+_db_dirty = asyncio.Event()
+_blob_dirty = False
+_dirty_rows: set[tuple[str, str]] = set()  # (раздел, uid) из _ROW_SECTIONS, ждущие записи
+DB_FLUSH_DELAY = 0.25
+_flusher_task: Optional[asyncio.Task] = None  # graceful_shutdown гасит его до финальной записи
+
+
+# Небольшая очередь: при отставании воркеров монитор ждёт на put(), а не буферизует
+# тысячи транзакций в памяти
+QUEUE_SIZE = 256
 
-tx_queue:  Queue = Queue(maxsize=8_000)
-log_queue: Queue = Queue(maxsize=8_000)
+tx_queue:  Queue = Queue(maxsize=QUEUE_SIZE)
+log_queue: Queue = Queue(maxsize=QUEUE_SIZE)
 
 _shutdown    = False
+_shutdown_event = asyncio.Event()  # ставится вместе с _shutdown — для тех, кто ждёт, а не опрашивает
 _main_tasks: list[asyncio.Task] = []
 
+# Цены пишет только refresh_prices_loop; горячий путь читает их без блокировок
 _price_cache: dict[str, float] = {}
 _price_cache_ts: float = 0.0
-PRICE_TTL = 120
+PRICE_REFRESH_INTERVAL = 60
 
 _token_price_cache: dict[str, tuple[float, float]] = {}
+TOKEN_PRICE_CACHE_MAX = 2_000
+TOKEN_PRICE_BATCH = 100  # адресов в одном запросе contract_addresses=a,b,c
 
 LIMIT_MIN_USD = 100.0
 
 _decimals_cache: dict[str, int] = {}
+DECIMALS_CACHE_MAX = 10_000
 
+# Кеш исходников контрактов: addr -> (code | None, ts). Отрицательные ответы живут меньше
+_source_code_cache: dict[str, tuple[Optional[str], float]] = {}
+SOURCE_CODE_TTL = 3600
+SOURCE_CODE_NEG_TTL = 300
+SOURCE_CODE_CACHE_MAX = 1024
+SOURCE_CODE_MAX_LEN = 15000
+AUDIT_CACHE_TTL = 3600
+
+# Порядок вставки = порядок ts (set_state переставляет запись в конец)
 _user_states: dict[int, dict] = {}
 STATE_TTL = 600
+STATE_MAX = 50_000
+
+# Что показано в сообщении Guardian: (chat_id, message_id) -> (protected, scans, token_id)
+_guardian_last_rendered: dict[tuple[int, int], tuple[int, int, int]] = {}
+GUARDIAN_RENDER_CACHE_MAX = 1024
 
 # Последнее сообщение бота для каждого пользователя (чтобы удалять при новом действии)
 _last_bot_message: dict[int, int] = {}
+LAST_MESSAGE_MAX = 50_000
 
 # Rate limiting для пользователей
 _user_rate_limits = defaultdict(list)  # user_id -> list of timestamps
@@ -215,8 +305,40 @@ RATE_WINDOW = 3600     # окно в секундах (1 час)
 # УТИЛИТЫ
 # ---------------------------------------------------------------------------
 
+# Таблица замен для esc — то же, что html.escape(quote=True), одним проходом translate
+_ESC_TABLE = str.maketrans({
+    "&": "&amp;",
+    "<": "&lt;",
+    ">": "&gt;",
+    '"': "&quot;",
+    "'": "&#x27;",
+})
+
+
 def esc(text: str) -> str:
-    return html.escape(str(text))
+    return str(text).translate(_ESC_TABLE)
+
+
+# Из суммы вида "$5,000" выкидываем "$" и запятые одним проходом
+_AMOUNT_STRIP = str.maketrans("", "", "$,")
+
+
+def parse_amount(text: str) -> float:
+    # Пробелы по краям float() отбрасывает сам; внутри числа ("1 000") — ошибка, как и раньше
+    return float(text.translate(_AMOUNT_STRIP))
+
+
+_ADDR_RE = re.compile(r"0x[0-9a-fA-F]{40}")
+
+
+def is_addr_fast(addr: str) -> bool:
+    """Формат адреса без проверки checksum — там, где регистр не важен (GoPlus, ignore/watch)"""
+    return bool(_ADDR_RE.fullmatch(addr))
+
+
+def esc_addr(addr: str) -> str:
+    """Адрес уже прошёл валидацию (hex) — HTML-спецсимволов в нём нет, экранировать нечего"""
+    return addr
 
 
 def score_emoji(score: int) -> str:
@@ -228,6 +350,14 @@ def score_emoji(score: int) -> str:
         return "🔴"
 
 
+def bounded_put(cache: dict, key, value, max_size: int) -> None:
+    """Кладёт значение в dict-кеш, вытесняя самую старую запись при переполнении"""
+    cache.pop(key, None)
+    if len(cache) >= max_size:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
 def get_state(uid: int) -> Optional[str]:
     e = _user_states.get(uid)
     if not e:
@@ -238,14 +368,53 @@ def get_state(uid: int) -> Optional[str]:
     return e["state"]
 
 
+def _sweep_states(now: float) -> None:
+    """Удаляет протухшие состояния с головы dict — до первого живого"""
+    expired = []
+    for uid, e in _user_states.items():
+        if now - e["ts"] <= STATE_TTL:
+            break
+        expired.append(uid)
+    for uid in expired:
+        del _user_states[uid]
+
+
 def set_state(uid: int, state: str) -> None:
-    _user_states[uid] = {"state": state, "ts": time.time()}
+    now = time.time()
+    _sweep_states(now)
+    bounded_put(_user_states, uid, {"state": state, "ts": now}, STATE_MAX)
 
 
 def clear_state(uid: int) -> None:
     _user_states.pop(uid, None)
 
 
+def set_pending_verification(uid: int, nonce: str) -> None:
+    """
+    Создаёт сессию верификации и индекс nonce -> uid. Вызывать под user_lock(uid):
+    он сериализует сессию одного пользователя. Общий nonce_index db_lock не
+    требует — внутри нет ни одного await, в одном event loop правка атомарна,
+    а ключи индекса — случайные nonce, у разных пользователей они не пересекаются.
+    """
+    uid_str = str(uid)
+    index = db.setdefault("nonce_index", {})
+    old = db["pending_verifications"].get(uid_str)
+    if old:
+        index.pop(old.get("nonce"), None)
+    db["pending_verifications"][uid_str] = {
+        "nonce": nonce,
+        "ts": time.time(),
+    }
+    index[nonce] = uid
+
+
+def pop_pending_verification(uid_str: str) -> None:
+    """Удаляет сессию верификации вместе с записью индекса. Вызывать под user_lock(uid_str) — см. set_pending_verification."""
+    pending = db["pending_verifications"].pop(uid_str, None)
+    if pending:
+        db.get("nonce_index", {}).pop(pending.get("nonce"), None)
+
+
 def is_owner(uid: int) -> bool:
     return uid in OWNERS
 
@@ -270,10 +439,64 @@ def check_rate_limit(user_id: int, action: str) -> tuple[bool, int]:
     return True, remaining
 
 
+CACHE_SWEEP_INTERVAL = 60
+
+
+def _drop_expired(cache: dict, is_expired: Callable[[object], bool]) -> int:
+    expired = [k for k, v in cache.items() if is_expired(v)]
+    for k in expired:
+        del cache[k]
+    return len(expired)
+
+
+async def _cache_sweeper() -> None:
+    """
+    Периодически чистит кеши, которые иначе чистятся только при обращении
+    к тому же ключу (или не чистятся вовсе)
+    """
+    while not _shutdown:
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+        now, mono = time.time(), time.monotonic()
+        _sweep_states(now)
+        _drop_expired(_user_rate_limits, lambda ts: not ts or now - ts[-1] >= RATE_WINDOW)
+        _drop_expired(_rpc_cache, lambda e: mono - e[1] >= RPC_CACHE_TTL)
+        _drop_expired(_source_code_cache, lambda e: now - e[1] >= (
+            SOURCE_CODE_TTL if e[0] else SOURCE_CODE_NEG_TTL
+        ))
+        # Аудиты лежат в блобе bot_data — протухшие только раздувают каждую запись
+        async with db_lock:
+            dropped = sum(
+                _drop_expired(db.get(section, {}), lambda e: now - e["timestamp"] >= AUDIT_CACHE_TTL)
+                for section in ("audit_cache", "audit_cache_by_hash")
+            )
+        if dropped:
+            mark_db_dirty()
+
+
 # ---------------------------------------------------------------------------
 # POSTGRESQL
 # ---------------------------------------------------------------------------
 
+def _jsonb_dumps(value) -> bytes:
+    try:
+        # orjson в разы быстрее json.dumps; OPT_NON_STR_KEYS — как json, int-ключи в строки
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        # Например, int больше 64 бит — стандартный json справится
+        return json.dumps(value).encode()
+
+
+async def _init_pg_conn(conn: asyncpg.Connection) -> None:
+    """JSONB в бинарном формате: параметры и результаты — сразу Python-объекты"""
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=lambda value: b"\x01" + _jsonb_dumps(value),  # 1 — версия формата jsonb
+        decoder=lambda data: orjson.loads(data[1:]),
+        schema="pg_catalog",
+        format="binary",
+    )
+
+
 async def init_db():
     global pool, db
     db_url = os.getenv("DATABASE_URL")
@@ -284,7 +507,8 @@ async def init_db():
 
     try:
         # Создаем пул соединений к твоему Postgres на Railway
-        pool = await asyncpg.create_pool(db_url)
+        # Подготовленные запросы asyncpg кеширует сам (statement cache на соединение)
+        pool = await asyncpg.create_pool(db_url, init=_init_pg_conn)
         
         async with pool.acquire() as conn:
             # Создаем таблицу, если её нет (используем тип JSONB для скорости)
@@ -295,49 +519,194 @@ async def init_db():
                 )
             """)
             
+            # Пользовательские разделы — построчно, чтобы изменение одного
+            # пользователя не переписывало весь JSON-блоб
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_rows (
+                    section TEXT NOT NULL,
+                    uid TEXT NOT NULL,
+                    data JSONB NOT NULL,
+                    PRIMARY KEY (section, uid)
+                )
+            """)
+            
             row = await conn.fetchrow("SELECT data FROM bot_data WHERE id = 1")
             if row:
                 # Загружаем данные из Postgres
-                loaded_data = json.loads(row['data'])
-                db.update({**_DB_DEFAULT, **loaded_data})
+                loaded_data = row['data']
+                db.update({**_make_default_db(), **loaded_data})
                 logger.info("✅ Статистика успешно загружена из PostgreSQL")
                 logger.info(f"🔍 init_db: загруженный лимит из БД = {db['cfg']['limit_usd']}")
+
+                # Миграция: старые БД держали эти разделы внутри блоба
+                legacy = [
+                    (section, uid_str, value)
+                    for section in _ROW_SECTIONS
+                    for uid_str, value in loaded_data.get(section, {}).items()
+                ]
+                if legacy:
+                    # Перенос и очищенный блоб — одной транзакцией: иначе при падении
+                    # между ними старые разделы в блобе вернули бы удалённые записи
+                    async with conn.transaction():
+                        await conn.executemany(
+                            "INSERT INTO user_rows (section, uid, data) VALUES ($1, $2, $3) "
+                            "ON CONFLICT (section, uid) DO NOTHING",
+                            legacy,
+                        )
+                        await conn.execute("UPDATE bot_data SET data = $1 WHERE id = 1", _db_blob())
+                    logger.info(f"📦 Перенесено {len(legacy)} записей в user_rows")
             else:
                 # Если база пустая, создаем первую запись
-                db.update(_DB_DEFAULT.copy())
-                await conn.execute("INSERT INTO bot_data (id, data) VALUES (1, $1)", json.dumps(db))
+                db.update(_make_default_db())
+                await conn.execute("INSERT INTO bot_data (id, data) VALUES (1, $1)", _db_blob())
                 logger.info("🆕 Создана новая запись в PostgreSQL")
                 logger.info(f"🔍 Лимит по умолчанию: {db['cfg']['limit_usd']}")
+
+            for section in _ROW_SECTIONS:
+                db[section] = {}
+            for r in await conn.fetch("SELECT section, uid, data FROM user_rows"):
+                if r['section'] in _ROW_SECTIONS:
+                    db[r['section']][r['uid']] = r['data']
+            _normalize_wallet_rows()
             
             # Убедимся что audit_cache существует
             if "audit_cache" not in db:
                 db["audit_cache"] = {}
+            # Индекс nonce -> uid восстанавливаем из сессий (старые БД его не содержат)
+            db["nonce_index"] = {
+                p["nonce"]: int(uid_str)
+                for uid_str, p in db["pending_verifications"].items()
+                if p.get("nonce")
+            }
     except Exception as e:
         logger.error(f"❌ Ошибка подключения к Postgres: {e}")
         # Fallback на пустую базу в памяти, если Postgres лег
-        db.update(_DB_DEFAULT.copy())
+        db.update(_make_default_db())
+
+def _normalize_wallet_rows() -> None:
+    """
+    Адреса в connected_wallets — только в нижнем регистре: _wallet_watchers и
+    _is_connected_wallet сравнивают их без .lower(). Записи, сделанные до того,
+    как verify_wallet стал приводить регистр, правим один раз при загрузке.
+    """
+    fixed = 0
+    for uid_str, wallets in db["connected_wallets"].items():
+        if any(w["address"] != w["address"].lower() for w in wallets):
+            for w in wallets:
+                w["address"] = w["address"].lower()
+            mark_user_dirty("connected_wallets", uid_str)
+            fixed += 1
+    if fixed:
+        logger.info(f"🔡 Адреса кошельков приведены к нижнему регистру: {fixed} записей")
+
+
+def _db_blob() -> orjson.Fragment:
+    """
+    Общий блоб bot_data без построчных разделов и производных индексов.
+    Кодируется сразу (снимок), Fragment уходит в кодек jsonb без повторной сериализации.
+    """
+    return orjson.Fragment(_jsonb_dumps({k: v for k, v in db.items() if k not in _BLOB_EXCLUDE}))
+
 
 async def save_db():
     if not pool: 
         logger.warning("⚠️ save_db: pool отсутствует, сохранение пропущено")
         return
+    # Снимок под db_lock — не поймаем состояние посреди многошаговой правки;
+    # сама запись в Postgres идёт уже без блокировки
+    async with db_lock:
+        blob = _db_blob()
     try:
         async with pool.acquire() as conn:
             await conn.execute(
                 "INSERT INTO bot_data (id, data) VALUES (1, $1) "
                 "ON CONFLICT (id) DO UPDATE SET data = $1",
-                json.dumps(db)
+                blob
             )
         logger.info("✅ БД сохранена")
     except Exception as e:
         logger.warning(f"⚠️ Ошибка сохранения в Postgres: {e}")
 
 
+async def save_user_rows(keys: set[tuple[str, str]]) -> bool:
+    """Пишет (или удаляет) записи разделов из _ROW_SECTIONS одной транзакцией"""
+    if not pool:
+        return True
+    upserts, deletes = [], []
+    for section, uid_str in keys:
+        value = db[section].get(uid_str)
+        if value is None:
+            deletes.append((section, uid_str))
+        else:
+            upserts.append((section, uid_str, value))
+    try:
+        async with pool.acquire() as conn, conn.transaction():
+            if deletes:
+                await conn.executemany(
+                    "DELETE FROM user_rows WHERE section = $1 AND uid = $2",
+                    deletes,
+                )
+            if upserts:
+                await conn.executemany(
+                    "INSERT INTO user_rows (section, uid, data) VALUES ($1, $2, $3) "
+                    "ON CONFLICT (section, uid) DO UPDATE SET data = $3",
+                    upserts,
+                )
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка сохранения {len(keys)} записей user_rows в Postgres: {e}")
+        return False
+
+
+def mark_db_dirty() -> None:
+    """Помечает общий блоб изменённым — запись выполнит фоновый _db_flusher"""
+    global _blob_dirty
+    _blob_dirty = True
+    _db_dirty.set()
+
+
+def mark_user_dirty(section: str, uid_str: str) -> None:
+    """Помечает запись раздела из _ROW_SECTIONS — _db_flusher запишет её вместе с остальными"""
+    _dirty_rows.add((section, uid_str))
+    _db_dirty.set()
+
+
+async def flush_db(force_blob: bool = False) -> None:
+    """
+    Записывает всё накопленное: изменённые user_rows и, если нужно, блоб.
+    force_blob — при остановке: часть счётчиков меняется без mark_db_dirty.
+    """
+    global _blob_dirty
+    if _dirty_rows:
+        keys = set(_dirty_rows)
+        _dirty_rows.clear()
+        try:
+            saved = await save_user_rows(keys)
+        except asyncio.CancelledError:
+            _dirty_rows.update(keys)  # запись прервана — ключи заберёт финальный flush_db
+            raise
+        if not saved:
+            _dirty_rows.update(keys)  # повторим при следующей записи
+    if _blob_dirty or force_blob:
+        _blob_dirty = False
+        await save_db()
+
+
+async def _db_flusher() -> None:
+    """Склеивает серию изменений БД в одну запись в PostgreSQL"""
+    while not _shutdown:
+        await _db_dirty.wait()
+        await asyncio.sleep(DB_FLUSH_DELAY)
+        # Сбрасываем флаг до записи: изменения во время flush_db вызовут ещё один проход
+        _db_dirty.clear()
+        await flush_db()
+
+
 # ---------------------------------------------------------------------------
 # ЦЕНЫ
 # ---------------------------------------------------------------------------
 
-async def _fetch_bnb_price() -> float:
+async def _fetch_bnb_price() -> Optional[float]:
     try:
         timeout = aiohttp.ClientTimeout(total=8)
         async with http_session.get(
@@ -346,15 +715,24 @@ async def _fetch_bnb_price() -> float:
             timeout=timeout,
         ) as r:
             if r.status == 200:
-                data = await r.json()
+                data = orjson.loads(await r.read())
                 return float(data["binancecoin"]["usd"])
     except Exception as e:
         logger.warning(f"BNB price fetch error: {e}")
-    return 600.0  # fallback
+    return None
 
 
 async def fetch_source_code(contract_address: str) -> Optional[str]:
-    """Выкачивает исходный код контракта через API BscScan/opBNBScan"""
+    """Выкачивает исходный код контракта через API BscScan/opBNBScan (с TTL-кешем)"""
+    key = contract_address.lower()
+    now = time.time()
+    cached = _source_code_cache.get(key)
+    if cached is not None:
+        code, ts = cached
+        ttl = SOURCE_CODE_TTL if code else SOURCE_CODE_NEG_TTL
+        if now - ts < ttl:
+            return code
+
     api_key = os.getenv("BSCSCAN_API_KEY")
     if not api_key:
         return None
@@ -364,57 +742,83 @@ async def fetch_source_code(contract_address: str) -> Optional[str]:
     
     try:
         async with http_session.get(url, timeout=10) as r:
-            data = await r.json()
+            data = orjson.loads(await r.read())
+            code = None
             if data['status'] == '1':
                 # Извлекаем код (он может быть в разном формате, берем первый файл)
                 source = data['result'][0].get('SourceCode', '')
-                return source[:15000] # Ограничиваем длину, чтобы ИИ не подавился
-            return None
+                code = source[:SOURCE_CODE_MAX_LEN] or None  # Ограничиваем длину, чтобы ИИ не подавился
     except Exception as e:
+        # Сетевые ошибки не кешируем — следующий запрос попробует снова
         logger.error(f"Ошибка выкачивания кода: {e}")
         return None
 
-async def _fetch_token_price(token_addr: str) -> float:
+    bounded_put(_source_code_cache, key, (code, now), SOURCE_CODE_CACHE_MAX)
+    return code
+
+async def _fetch_token_prices(token_addrs: list[str]) -> dict[str, float]:
+    """Цены токенов одним запросом CoinGecko (адреса через запятую)"""
     try:
         timeout = aiohttp.ClientTimeout(total=8)
         url = (
             "https://api.coingecko.com/api/v3/simple/token_price/binance-smart-chain"
-            f"?contract_addresses={token_addr}&vs_currencies=usd"
+            f"?contract_addresses={','.join(token_addrs)}&vs_currencies=usd"
         )
         async with http_session.get(url, timeout=timeout) as r:
             if r.status == 200:
-                data = await r.json()
-                entry = data.get(token_addr.lower(), {})
-                return float(entry.get("usd", 0.0))
+                data = orjson.loads(await r.read())
+                return {
+                    addr: float(data.get(addr.lower(), {}).get("usd", 0.0))
+                    for addr in token_addrs
+                }
     except Exception as e:
-        logger.warning(f"Token price fetch error {token_addr[:10]}: {e}")
-    return 0.0
+        logger.warning(f"Token price fetch error ({len(token_addrs)} шт.): {e}")
+    return {}
 
 
 async def refresh_bnb_price() -> None:
     global _price_cache_ts
-    async with price_lock:
-        if time.time() - _price_cache_ts < PRICE_TTL:
-            return
-        price = await _fetch_bnb_price()
-        _price_cache["BNB"] = price
-        _price_cache_ts = time.time()
-        logger.info(f"💰 BNB = ${price:.2f}")
+    price = await _fetch_bnb_price()
+    if price is None:
+        return  # оставляем последнюю известную цену
+    _price_cache["BNB"] = price
+    _price_cache_ts = time.time()
+    logger.info(f"💰 BNB = ${price:.2f}")
+
+
+async def refresh_token_prices() -> None:
+    tokens = list(_token_price_cache)
+    for i in range(0, len(tokens), TOKEN_PRICE_BATCH):
+        batch  = tokens[i:i + TOKEN_PRICE_BATCH]
+        prices = await _fetch_token_prices(batch)
+        now    = time.time()
+        for addr, price in prices.items():
+            if addr in _token_price_cache:  # могли вытеснить, пока ждали ответ
+                _token_price_cache[addr] = (price, now)
+
+
+async def refresh_prices_loop() -> None:
+    """Фоновое обновление цен BNB и уже встреченных токенов"""
+    while not _shutdown:
+        await asyncio.sleep(PRICE_REFRESH_INTERVAL)
+        try:
+            await asyncio.gather(refresh_bnb_price(), refresh_token_prices())
+        except Exception as e:
+            logger.error(f"refresh_prices_loop: {e}")
 
 
 async def bnb_to_usd(bnb: float) -> float:
-    await refresh_bnb_price()
     return bnb * _price_cache.get("BNB", 600.0)
 
 
 async def token_to_usd(token_addr: str, raw: int, decimals: int) -> float:
     amount = raw / (10 ** decimals)
-    now = time.time()
     cached = _token_price_cache.get(token_addr)
-    if cached is None or (now - cached[1]) > PRICE_TTL:
-        price = await _fetch_token_price(token_addr)
-        _token_price_cache[token_addr] = (price, now)
-        cached = (price, now)
+    if cached is None:
+        # Первая встреча токена: один запрос, дальше цену обновляет refresh_prices_loop
+        price = (await _fetch_token_prices([token_addr])).get(token_addr, 0.0)
+        cached = (price, time.time())
+        bounded_put(_token_price_cache, token_addr, cached, TOKEN_PRICE_CACHE_MAX)
     return amount * cached[0]
 
 
@@ -422,30 +826,262 @@ async def token_to_usd(token_addr: str, raw: int, decimals: int) -> float:
 # RPC
 # ---------------------------------------------------------------------------
 
-async def rpc(payload: dict) -> dict:
-    timeout = aiohttp.ClientTimeout(total=12)
-    async with rpc_sem:
-        last_error = None
-        for url in ALL_RPC_URLS: # <-- Используем все ссылки по очереди
-            try:
-                async with http_session.post(url, json=payload, timeout=timeout) as r:
-                    if r.status == 429:
-                        last_error = "RPC 429"
-                        continue
-                    r.raise_for_status()
-                    return await r.json()
-            except Exception as e:
-                last_error = str(e)
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Потоковый разбор окупается только на C-бэкенде ijson (yajl2_c)
+_IJSON_FAST = getattr(ijson, "backend", "") == "yajl2_c"
+
+RPC_HEDGE = 2            # максимум одновременных запросов к разным узлам
+# Хедж-запрос уходит, только если узел не ответил за ~2× свою EWMA-задержку:
+# обычно отвечает первый узел, и публичные RPC не получают лишней нагрузки
+RPC_HEDGE_FACTOR = 2.0
+RPC_HEDGE_DELAY_MIN = 0.3   # сек
+RPC_HEDGE_DELAY_MAX = 2.0   # сек — и для узлов без истории
+RPC_EWMA_ALPHA = 0.3
+RPC_FAIL_PENALTY = 12.0  # сек — упавший узел уходит в конец очереди
+_rpc_latency: dict[str, float] = {}  # url -> EWMA задержки, сек
+# Один объект на все вызовы; зависший TCP/TLS-коннект отваливается за 2 с,
+# а не съедает весь бюджет в 12 с
+_RPC_TIMEOUT = aiohttp.ClientTimeout(total=12, connect=2, sock_connect=2, sock_read=10)
+
+RPC_BACKOFF_MIN = 1.0
+RPC_BACKOFF_MAX = 30.0
+_rpc_backoff: dict[str, tuple[float, float]] = {}  # url -> (next_ok по monotonic, текущий backoff)
+
+
+def _record_rpc_latency(url: str, seconds: float) -> None:
+    prev = _rpc_latency.get(url)
+    _rpc_latency[url] = seconds if prev is None else (
+        RPC_EWMA_ALPHA * seconds + (1 - RPC_EWMA_ALPHA) * prev
+    )
+
+
+def _hedge_delay(url: str) -> float:
+    ewma = _rpc_latency.get(url)
+    if ewma is None:
+        return RPC_HEDGE_DELAY_MAX
+    return min(max(ewma * RPC_HEDGE_FACTOR, RPC_HEDGE_DELAY_MIN), RPC_HEDGE_DELAY_MAX)
+
+
+def _rpc_mark_down(url: str, retry_after: Optional[float] = None) -> None:
+    """Убирает узел из ротации: Retry-After от узла или удвоенный backoff (до 30 сек)"""
+    _, prev = _rpc_backoff.get(url, (0.0, RPC_BACKOFF_MIN / 2))
+    backoff = min(prev * 2, RPC_BACKOFF_MAX)
+    delay = min(retry_after, RPC_BACKOFF_MAX) if retry_after is not None else backoff
+    _rpc_backoff[url] = (time.monotonic() + delay, backoff)
+
+
+def _retry_after(r: aiohttp.ClientResponse) -> Optional[float]:
+    try:
+        return float(r.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None  # нет заголовка или там HTTP-дата — обойдёмся своим backoff
+
+
+class _RpcResultFilter:
+    """
+    Приёмник событий ijson.parse_coro: элементы result собирает по одному
+    и сразу фильтрует через keep, запоминает ключи верхнего уровня и error.
+    """
+
+    def __init__(self, keep: Callable[[dict], bool]):
+        self.keep = keep
+        self.items: list = []
+        self.keys: set[str] = set()
+        self.error = None
+        self._builder: Optional[ijson.ObjectBuilder] = None
+        self._depth = 0
+        self._prefix = ""
+
+    def send(self, event_tuple: tuple) -> None:
+        prefix, event, value = event_tuple
+        if self._builder is not None:
+            if event in ("start_map", "start_array"):
+                self._depth += 1
+            elif event in ("end_map", "end_array"):
+                self._depth -= 1
+            self._builder.event(event, value)
+            if self._depth == 0:
+                self._done(self._builder.value)
+            return
+        if prefix == "" and event == "map_key":
+            self.keys.add(value)
+        elif prefix in ("result.item", "error"):
+            self._prefix = prefix
+            if event in ("start_map", "start_array"):
+                self._builder = ijson.ObjectBuilder()
+                self._builder.event(event, value)
+                self._depth = 1
+            else:
+                self._done(value)
+
+    def _done(self, value) -> None:
+        self._builder = None
+        if self._prefix == "error":
+            self.error = value
+        elif self.keep(value):
+            self.items.append(value)
+
+
+async def _rpc_attempt(
+    url: str, body: bytes, timeout: aiohttp.ClientTimeout,
+    keep: Optional[Callable[[dict], bool]],
+) -> dict:
+    async with _rpc_sems[url]:
+        return await _rpc_post(url, body, timeout, keep)
+
+
+async def _rpc_post(
+    url: str, body: bytes, timeout: aiohttp.ClientTimeout,
+    keep: Optional[Callable[[dict], bool]],
+) -> dict:
+    started = time.monotonic()
+    try:
+        async with http_session.post(
+            url, data=body, headers=_JSON_HEADERS, timeout=timeout
+        ) as r:
+            if r.status == 429:
+                _rpc_mark_down(url, _retry_after(r))
+                raise RuntimeError("RPC 429")
+            r.raise_for_status()
+            if keep is None:
+                result = orjson.loads(await r.read())
+            elif not _IJSON_FAST:
+                # Чисто питоновый ijson медленнее, чем orjson целиком + фильтр
+                data = orjson.loads(await r.read())
+                if "result" in data:
+                    result = {"result": [item for item in data["result"] or [] if keep(item)]}
+                else:
+                    result = data  # JSON-RPC error — отдаём как есть, не как пустой result
+            else:
+                sink = _RpcResultFilter(keep)
+                parser = ijson.parse_coro(sink)
+                async for chunk in r.content.iter_any():
+                    parser.send(chunk)
+                parser.close()
+                if "result" in sink.keys:
+                    result = {"result": sink.items}
+                else:
+                    result = {"error": sink.error}
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _record_rpc_latency(url, RPC_FAIL_PENALTY)
+        if str(e) != "RPC 429":  # для 429 backoff уже выставлен
+            _rpc_mark_down(url)
+        raise
+    _record_rpc_latency(url, time.monotonic() - started)
+    _rpc_backoff.pop(url, None)
+    return result
+
+
+async def rpc(payload: dict, keep: Optional[Callable[[dict], bool]] = None) -> dict:
+    """
+    JSON-RPC запрос к самому быстрому узлу. Если он не ответил за
+    _hedge_delay() — тот же запрос уходит следующему (не больше RPC_HEDGE
+    одновременно), берётся первый успешный ответ, остальные отменяются.
+    Если упали все опрошенные узлы — сразу пробуем следующий.
+    Если передан keep, массив result разбирается потоково (ijson) и в ответ
+    попадают только элементы, для которых keep(item) истинно — большие
+    ответы eth_getLogs не материализуются целиком. Ответ с error (и без
+    result) возвращается как error, а не как пустой список.
+    """
+    body = orjson.dumps(payload)  # кодируем один раз для всех узлов
+    # Узлы в backoff — в самый конец (только если все здоровые упадут);
+    # неизвестные узлы (нет EWMA) идут первыми — так они получают шанс
+    now = time.monotonic()
+    urls = iter(sorted(ALL_RPC_URLS, key=lambda u: (
+        _rpc_backoff.get(u, (0.0, 0.0))[0] > now,
+        _rpc_latency.get(u, 0.0),
+    )))
+    pending: set[asyncio.Task] = set()
+    newest = ""        # последний опрошенный узел — по нему считаем задержку хеджа
+    exhausted = False  # узлы кончились
+    last_error = None
+
+    def launch() -> None:
+        nonlocal newest, exhausted
+        url = next(urls, None)
+        if url is None:
+            exhausted = True
+            return
+        newest = url
+        pending.add(asyncio.create_task(_rpc_attempt(url, body, _RPC_TIMEOUT, keep)))
+
+    launch()
+    try:
+        while pending:
+            can_hedge = not exhausted and len(pending) < RPC_HEDGE
+            done, pending = await asyncio.wait(
+                pending, timeout=_hedge_delay(newest) if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:  # узел не уложился в задержку — дублируем запрос на следующий
+                launch()
                 continue
-        
-        if last_error == "RPC 429":
-            raise RuntimeError("RPC 429 - все узлы перегружены")
-        raise RuntimeError(f"Все RPC узлы недоступны. Ошибка: {last_error}")
+            result = None
+            for t in done:
+                if t.exception() is None:
+                    result = t.result()
+                else:
+                    last_error = str(t.exception())
+            if result is not None:
+                return result
+            if not pending:  # все опрошенные упали — сразу следующий узел
+                launch()
+    finally:
+        for t in pending:
+            t.cancel()
+    
+    if last_error == "RPC 429":
+        raise RuntimeError("RPC 429 - все узлы перегружены")
+    raise RuntimeError(f"Все RPC узлы недоступны. Ошибка: {last_error}")
+
+
+RPC_CACHE_TTL = 5.0
+RPC_CACHE_MAX = 4096
+_rpc_cache: dict[bytes, tuple[dict, float]] = {}
+_rpc_inflight: dict[bytes, asyncio.Task] = {}
+
+
+def _rpc_cache_done(key: bytes, task: asyncio.Task) -> None:
+    _rpc_inflight.pop(key, None)
+    if task.cancelled() or task.exception() is not None:
+        return
+    data = task.result()
+    if data.get("result") is not None:  # пустые ответы (блока ещё нет) не кешируем
+        bounded_put(_rpc_cache, key, (data, time.monotonic()), RPC_CACHE_MAX)
+
+
+async def cached_rpc(
+    payload: dict, ttl: float = RPC_CACHE_TTL,
+    keep: Optional[Callable[[dict], bool]] = None,
+) -> dict:
+    """
+    rpc() с коротким TTL-кешем по (method, params) и single-flight:
+    одновременные одинаковые запросы ждут один и тот же вызов.
+    keep передаётся в rpc(); фильтр должен быть именованной функцией —
+    его имя входит в ключ кеша.
+    """
+    key = orjson.dumps([
+        payload["method"], payload.get("params"),
+        keep.__qualname__ if keep else None,
+    ])
+    hit = _rpc_cache.get(key)
+    if hit is not None and time.monotonic() - hit[1] < ttl:
+        return hit[0]
+    task = _rpc_inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(rpc(payload, keep=keep))
+        _rpc_inflight[key] = task
+        task.add_done_callback(lambda t: _rpc_cache_done(key, t))
+    # shield: отмена одного ожидающего не отменяет запрос для остальных
+    return await asyncio.shield(task)
 
 
 async def get_block(number: int) -> Optional[dict]:
     try:
-        data = await rpc({
+        data = await cached_rpc({
             "jsonrpc": "2.0", "method": "eth_getBlockByNumber",
             "params": [hex(number), True], "id": 1,
         })
@@ -455,9 +1091,22 @@ async def get_block(number: int) -> Optional[dict]:
         return None
 
 
+_ZERO_AMOUNT = frozenset({"0x", "0x0", "0x" + "0" * 64})
+
+
+def _is_fungible_transfer(log: dict) -> bool:
+    """
+    Отсекает логи, которые process_erc20_log всё равно выбросит:
+    ERC-721 Transfer (4 топика, tokenId индексирован) и нулевые суммы.
+    """
+    return len(log.get("topics") or ()) == 3 and log.get("data", "0x") not in _ZERO_AMOUNT
+
+
 async def get_logs(from_bn: int, to_bn: int) -> list[dict]:
+    # Фильтровать по адресам на стороне узла нельзя: киты ищутся по всей сети,
+    # а не только по подключённым кошелькам. Режем то, что точно не нужно.
     try:
-        data = await rpc({
+        data = await cached_rpc({
             "jsonrpc": "2.0", "method": "eth_getLogs",
             "params": [{
                 "fromBlock": hex(from_bn),
@@ -465,7 +1114,10 @@ async def get_logs(from_bn: int, to_bn: int) -> list[dict]:
                 "topics":    [ERC20_TRANSFER_TOPIC],
             }],
             "id": 1,
-        })
+        }, keep=_is_fungible_transfer)
+        if "error" in data:
+            logger.warning(f"get_logs {from_bn}-{to_bn}: {data['error']}")
+            return []
         return data.get("result") or []
     except Exception as e:
         logger.warning(f"get_logs {from_bn}-{to_bn}: {e}")
@@ -485,7 +1137,7 @@ async def get_decimals(token_addr: str) -> int:
         dec = int(result, 16) if result and result != "0x" else 18
     except Exception:
         dec = 18
-    _decimals_cache[token_addr] = dec
+    bounded_put(_decimals_cache, token_addr, dec, DECIMALS_CACHE_MAX)
     return dec
 
 
@@ -506,28 +1158,32 @@ _SCAN_ABI = [{
     "type": "function",
 }]
 
+OPBNB_CHAIN_ID = 204  # передаём явно — build_transaction не спрашивает eth_chainId
+
+@functools.lru_cache(maxsize=1)
+def _onchain_signer() -> tuple:
+    """Аккаунт и checksum-адрес контракта считаем один раз, а не на каждый лог"""
+    return Account.from_key(ONCHAIN_PRIVKEY), Web3.to_checksum_address(ONCHAIN_CONTRACT)
+
 async def log_onchain(target: str, score: int, is_safe: bool) -> None:
     if not ENABLE_ONCHAIN or not ONCHAIN_PRIVKEY or not ONCHAIN_CONTRACT:
         return
-    if not Web3.is_address(target) or not Web3.is_address(ONCHAIN_CONTRACT):
+    if not is_addr_fast(target) or not Web3.is_address(ONCHAIN_CONTRACT):
         return
 
-    def _do_log():
-        w3 = get_smart_w3(_RAW_HTTP_URL)
-        acct = w3.eth.account.from_key(ONCHAIN_PRIVKEY)
+    def _do_log(w3: Web3):
+        acct, contract_addr = _onchain_signer()
         
-        # Проверяем баланс
+        nonce, gas_price = fetch_tx_params(w3, acct.address, 'pending')
+
+        # Проверяем баланс (цена газа уже есть из батча выше)
         balance = w3.eth.get_balance(acct.address)
-        required = w3.eth.gas_price * 130_000
+        required = gas_price * 130_000
         if balance < required:
             logger.warning(f"Insufficient balance: {balance} wei, required: {required}")
             return None
         
-        contract = w3.eth.contract(
-            address=Web3.to_checksum_address(ONCHAIN_CONTRACT),
-            abi=_SCAN_ABI,
-        )
-        nonce = w3.eth.get_transaction_count(acct.address, 'pending')
+        contract = w3.eth.contract(address=contract_addr, abi=_SCAN_ABI)
         tx = contract.functions.logScan(
             Web3.to_checksum_address(target),
             score, is_safe, acct.address,
@@ -535,27 +1191,19 @@ async def log_onchain(target: str, score: int, is_safe: bool) -> None:
             "from":     acct.address,
             "nonce":    nonce,
             "gas":      130_000,
-            "gasPrice": w3.eth.gas_price,
+            "gasPrice": gas_price,
+            "chainId":  OPBNB_CHAIN_ID,
         })
-        signed = w3.eth.account.sign_transaction(tx, acct.key)
-        
-        # Пытаемся получить сырую транзакцию из разных атрибутов
-        raw_tx = (
-            getattr(signed, 'raw_transaction', None) or 
-            getattr(signed, 'rawTransaction', None) or 
-            getattr(signed, 'transaction', None)
-        )
-        if raw_tx is None:
-            raise AttributeError("Cannot find raw transaction attribute in signed object")
-        
-        tx_hash = w3.eth.send_raw_transaction(raw_tx)
+        tx_hash = w3.eth.send_raw_transaction(sign_raw_transaction(tx, acct.key))
         return tx_hash.hex()
 
     try:
         loop = asyncio.get_running_loop()
-        tx_hash = await loop.run_in_executor(None, _do_log)
+        w3 = await get_chain_w3()
+        tx_hash = await loop.run_in_executor(None, _do_log, w3)
         logger.info(f"On-chain log OK: {tx_hash[:20]}...")
     except Exception as e:
+        reset_chain_w3()  # возможно, узел умер — в следующий раз выберем другой
         logger.warning(f"On-chain log failed: {str(e)[:100]}")
 
 
@@ -563,25 +1211,67 @@ async def log_onchain(target: str, score: int, is_safe: bool) -> None:
 # AI
 # ---------------------------------------------------------------------------
 
+# Статические части промпта аудита — собираются один раз, в perform_audit
+# между ними подставляется только исходный код
+AUDIT_PROMPT_HEAD = """
+    Ты - эксперт по безопасности Solidity. Проанализируй этот код контракта на наличие бэкдоров:
+    """
+AUDIT_PROMPT_TAIL = """
+
+    Найди: 
+    1. Функции Mint (печать новых токенов).
+    2. Функции Pause (остановка торгов).
+    3. Скрытую смену владельца.
+    4. Логику Honeypot.
+
+    Ответь в формате JSON со следующими полями:
+    - verdict: одно из ["SAFE", "WARNING", "DANGER"] (SAFE = безопасно, WARNING = есть сомнения, DANGER = опасно)
+    - confidence: число от 0 до 1, где 1 = полная уверенность
+    - risk_factors: массив строк, описывающих найденные угрозы (например, ["mint function", "pause", "hidden owner"]). Если угроз нет, массив пустой.
+    - explanation: краткое пояснение для пользователя на русском (2-3 предложения)
+
+    Только JSON, без дополнительного текста.
+    """
+
+
+# Список (провайдер, ключ) собирается один раз при загрузке модуля
+_AI_CONFIGS: list[tuple[str, str]] = (
+    # [("xai",    k) for k in XAI_KEYS]  +   # ← xAI отключён
+    [("groq",   k) for k in GROQ_KEYS] +
+    [("gemini", k) for k in GEMINI_KEYS] +
+    [("deepseek", k) for k in DEEPSEEK_KEYS]
+)
+AI_EWMA_ALPHA = 0.3
+AI_FAIL_PENALTY = 30.0  # сек — провайдер с ошибкой уходит в конец очереди
+_ai_latency: dict[tuple[str, str], float] = {}  # (провайдер, ключ) -> EWMA задержки, сек
+
+
+def _record_ai_latency(cfg: tuple[str, str], seconds: float) -> None:
+    prev = _ai_latency.get(cfg)
+    _ai_latency[cfg] = seconds if prev is None else (
+        AI_EWMA_ALPHA * seconds + (1 - AI_EWMA_ALPHA) * prev
+    )
+
+
 async def call_ai(prompt: str) -> dict:
     """
     Отправляет промпт AI и возвращает структурированный ответ в виде словаря.
     Если не удалось получить или распарсить JSON, возвращает словарь с ошибкой.
     """
-    configs = (
-        # [("xai",    k) for k in XAI_KEYS]  +   # ← xAI отключён
-        [("groq",   k) for k in GROQ_KEYS] +
-        [("gemini", k) for k in GEMINI_KEYS] +
-        [("deepseek", k) for k in DEEPSEEK_KEYS]
-    )
-    if not configs:
+    if not _AI_CONFIGS:
         return {"verdict": "ERROR", "confidence": 0.0, "risk_factors": [], "explanation": "AI-ключи не настроены."}
 
+    # Сначала самые быстрые и надёжные; ещё не опробованные — в исходном порядке
+    configs = sorted(_AI_CONFIGS, key=lambda cfg: _ai_latency.get(cfg, 0.0))
+
     async with ai_sem:
-        for provider, key in configs:
+        for cfg in configs:
+            provider, key = cfg
             logger.info(f"🤖 Пробуем AI провайдера: {provider}")
+            started = time.monotonic()
             try:
                 result_str = await _ai_request(provider, key, prompt)
+                _record_ai_latency(cfg, time.monotonic() - started if result_str else AI_FAIL_PENALTY)
                 if result_str:
                     # Пытаемся распарсить JSON
                     try:
@@ -591,7 +1281,7 @@ async def call_ai(prompt: str) -> dict:
                             cleaned = cleaned[7:]
                         if cleaned.endswith("```"):
                             cleaned = cleaned[:-3]
-                        result_json = json.loads(cleaned)
+                        result_json = orjson.loads(cleaned)
                         # Проверяем наличие обязательных полей
                         required = ["verdict", "confidence", "risk_factors", "explanation"]
                         if all(k in result_json for k in required):
@@ -599,7 +1289,7 @@ async def call_ai(prompt: str) -> dict:
                             return result_json
                         else:
                             logger.warning(f"⚠️ AI [{provider}] вернул неполный JSON: {result_json}")
-                    except json.JSONDecodeError as e:
+                    except orjson.JSONDecodeError as e:
                         logger.warning(f"⚠️ AI [{provider}] вернул невалидный JSON: {result_str[:200]}, ошибка: {e}")
                     # Если не удалось распарсить, возвращаем дефолт с текстом как explanation
                     return {
@@ -611,6 +1301,7 @@ async def call_ai(prompt: str) -> dict:
                 else:
                     logger.warning(f"⚠️ AI [{provider}] вернул пустой ответ")
             except Exception as e:
+                _record_ai_latency(cfg, AI_FAIL_PENALTY)
                 logger.warning(f"❌ AI [{provider}] ошибка: {e}")
 
     return {"verdict": "ERROR", "confidence": 0.0, "risk_factors": [], "explanation": "Все AI-провайдеры временно недоступны."}
@@ -661,7 +1352,7 @@ async def _ai_request(provider: str, key: str, prompt: str) -> Optional[str]:
         if r.status != 200:
             txt = await r.text()
             raise RuntimeError(f"HTTP {r.status}: {txt[:200]}")
-        data = await r.json()
+        data = orjson.loads(await r.read())
 
     if provider == "gemini":
         candidates = data.get("candidates") or []
@@ -679,7 +1370,7 @@ async def _ai_request(provider: str, key: str, prompt: str) -> Optional[str]:
 # ---------------------------------------------------------------------------
 
 async def check_scam(addr: str) -> list[str]:
-    if not Web3.is_address(addr):
+    if not is_addr_fast(addr):
         return []
     url = (
         f"https://api.gopluslabs.io/api/v1/token_security/204"
@@ -693,7 +1384,7 @@ async def check_scam(addr: str) -> list[str]:
         ) as r:
             if r.status != 200:
                 return []
-            data = await r.json()
+            data = orjson.loads(await r.read())
             d = data.get("result", {}).get(addr.lower(), {})
             risks: list[str] = []
             if d.get("is_honeypot")          == "1": risks.append("🍯 HONEYPOT")
@@ -723,7 +1414,9 @@ async def safe_send(chat_id: int, text: str, **kwargs) -> None:
                 db["connected_wallets"].pop(uid_str, None)
                 db["user_guardians"].pop(uid_str, None)
                 db["user_limits"].pop(uid_str, None)
-            await save_db()
+            mark_db_dirty()
+            mark_user_dirty("connected_wallets", uid_str)
+            mark_user_dirty("user_limits", uid_str)
             return
     except Exception as e:
         logger.warning(f"Failed to get chat {chat_id}: {e}")
@@ -742,11 +1435,13 @@ async def notify_owners(text: str) -> None:
     )
 
 
+# Адреса в connected_wallets хранятся уже в нижнем регистре (см. verify_wallet)
+
 def _wallet_watchers(address: str) -> list[int]:
     addr = address.lower()
     result = []
     for uid_str, wallets in db.get("connected_wallets", {}).items():
-        if any(w["address"].lower() == addr for w in wallets):
+        if any(w["address"] == addr for w in wallets):
             result.append(int(uid_str))
     return result
 
@@ -754,7 +1449,7 @@ def _wallet_watchers(address: str) -> list[int]:
 def _is_connected_wallet(address: str) -> bool:
     addr = address.lower()
     for wallets in db.get("connected_wallets", {}).values():
-        if any(w["address"].lower() == addr for w in wallets):
+        if any(w["address"] == addr for w in wallets):
             return True
     return False
 
@@ -835,8 +1530,8 @@ async def process_bnb_tx(tx: dict) -> None:
             wallet_alert = (
                 f"🔔 <b>Активность кошелька</b>\n\n"
                 f"💸 <b>{val_bnb:.4f} BNB</b> (≈ ${val_usd:,.0f})\n"
-                f"From: <code>{esc(sender[:8] + '...' + sender[-4:])}</code>\n"
-                f"To:   <code>{esc(target[:8] + '...' + target[-4:])}</code>"
+                f"From: <code>{esc_addr(sender[:8] + '...' + sender[-4:])}</code>\n"
+                f"To:   <code>{esc_addr(target[:8] + '...' + target[-4:])}</code>"
             )
             for uid in set(watchers):
                 await safe_send(uid, wallet_alert)
@@ -852,8 +1547,8 @@ async def process_bnb_tx(tx: dict) -> None:
         whale_text = (
             f"🐳 <b>WHALE — BNB</b>\n"
             f"💰 <b>{val_bnb:.4f} BNB</b> (≈ ${val_usd:,.0f})\n"
-            f"From: <code>{esc(sender[:8] + '...' + sender[-4:])}</code>\n"
-            f"To:   <code>{esc(target[:8] + '...' + target[-4:])}</code>"
+            f"From: <code>{esc_addr(sender[:8] + '...' + sender[-4:])}</code>\n"
+            f"To:   <code>{esc_addr(target[:8] + '...' + target[-4:])}</code>"
         )
 
         if sender in watch or target in watch:
@@ -934,9 +1629,9 @@ async def process_erc20_log(log: dict) -> None:
             wallet_alert = (
                 f"🔔 <b>Активность кошелька (Token)</b>\n\n"
                 f"💸 <b>{amount:,.2f} токенов</b> (≈ ${val_usd:,.0f})\n"
-                f"Токен: <code>{esc(token_addr[:8] + '...' + token_addr[-4:])}</code>\n"
-                f"From:  <code>{esc(sender[:8] + '...' + sender[-4:])}</code>\n"
-                f"To:    <code>{esc(receiver[:8] + '...' + receiver[-4:])}</code>"
+                f"Токен: <code>{esc_addr(token_addr[:8] + '...' + token_addr[-4:])}</code>\n"
+                f"From:  <code>{esc_addr(sender[:8] + '...' + sender[-4:])}</code>\n"
+                f"To:    <code>{esc_addr(receiver[:8] + '...' + receiver[-4:])}</code>"
             )
             for uid in set(watchers):
                 await safe_send(uid, wallet_alert)
@@ -952,9 +1647,9 @@ async def process_erc20_log(log: dict) -> None:
         whale_text = (
             f"🐋 <b>WHALE — TOKEN</b>\n"
             f"💰 <b>{amount:,.2f} токенов</b> (≈ ${val_usd:,.0f})\n"
-            f"Токен: <code>{esc(token_addr[:8] + '...' + token_addr[-4:])}</code>\n"
-            f"From:  <code>{esc(sender[:8] + '...' + sender[-4:])}</code>\n"
-            f"To:    <code>{esc(receiver[:8] + '...' + receiver[-4:])}</code>"
+            f"Токен: <code>{esc_addr(token_addr[:8] + '...' + token_addr[-4:])}</code>\n"
+            f"From:  <code>{esc_addr(sender[:8] + '...' + sender[-4:])}</code>\n"
+            f"To:    <code>{esc_addr(receiver[:8] + '...' + receiver[-4:])}</code>"
         )
 
         if sender in watch or receiver in watch:
@@ -1079,16 +1774,10 @@ async def monitor() -> None:
                     if isinstance(block, Exception) or not block:
                         continue
                     for tx in block.get("transactions", []):
-                        if tx_queue.full():
-                            logger.warning("TX queue full — пропускаем")
-                        else:
-                            await tx_queue.put(tx)
+                        await tx_queue.put(tx)
 
                 for log in logs:
-                    if log_queue.full():
-                        logger.warning("Log queue full — пропускаем")
-                    else:
-                        await log_queue.put(log)
+                    await log_queue.put(log)
 
             async with db_lock:
                 db["stats"]["blocks"] += to_proc
@@ -1096,7 +1785,7 @@ async def monitor() -> None:
 
             save_counter += to_proc
             if save_counter >= SAVE_EVERY:
-                await save_db()
+                mark_db_dirty()
                 save_counter = 0
 
         except Exception as e:
@@ -1121,7 +1810,7 @@ def get_cached_audit(addr: str) -> Optional[str]:
     entry = cache.get(addr.lower())
     if entry:
         age = time.time() - entry["timestamp"]
-        if age < 3600:  # 1 час
+        if age < AUDIT_CACHE_TTL:  # 1 час
             result = entry["result"]
             # Если результат - словарь (новый формат), формируем текст из него
             if isinstance(result, dict):
@@ -1159,15 +1848,14 @@ async def verify_wallet(user_id: int, address: str, signature: str) -> tuple[boo
     if not Web3.is_address(address):
         return False, "Невалидный адрес"
 
-    async with db_lock:
+    async with user_lock(uid_str):
         pending = db["pending_verifications"].get(uid_str)
         if not pending: return False, "Сессия не найдена"
         
-        # Проверка подписи (оставляем твою рабочую логику)
+        # Восстановление адреса из подписи — чисто локальная операция, RPC не нужен
         try:
-            w3_l = get_smart_w3(_RAW_HTTP_URL)
             msg = encode_defunct(text=f"VibeGuard verification: {pending['nonce']}")
-            recovered = w3_l.eth.account.recover_message(msg, signature=signature)
+            recovered = Account.recover_message(msg, signature=signature)
             if recovered.lower() != address.lower():
                 return False, "Подпись не совпадает"
         except Exception as e:
@@ -1175,9 +1863,10 @@ async def verify_wallet(user_id: int, address: str, signature: str) -> tuple[boo
 
 # СТРОГО 1 КОШЕЛЕК: Перезаписываем список, старые удаляются
         db["connected_wallets"][uid_str] = [{"address": address.lower(), "label": "Main Wallet"}]
-        db["pending_verifications"].pop(uid_str, None)
+        pop_pending_verification(uid_str)
 
-    await save_db()
+    mark_user_dirty("connected_wallets", uid_str)
+    mark_user_dirty("pending_verifications", uid_str)
     return True, "✅ Кошелёк успешно привязан"
 
 
@@ -1207,7 +1896,7 @@ async def mint_guardian_for_user(uid: int):
             if "user_guardians" not in db:
                 db["user_guardians"] = {}
             db["user_guardians"][str(uid)] = token_id
-        await save_db()
+        mark_db_dirty()
         logger.info(f"🛡️ Guardian NFT заминчен: token_id={token_id} для user_id={uid}")
     except Exception as e:
         logger.error(f"❌ Ошибка минта Guardian для user_id={uid}: {e}", exc_info=True)
@@ -1238,7 +1927,7 @@ async def send_and_clean(chat_id: int, text: str, reply_markup=None, user_id: in
             logger.debug(f"Не удалось удалить предыдущее сообщение: {e}")
     # Отправляем новое
     msg = await bot.send_message(chat_id, text, reply_markup=reply_markup)
-    _last_bot_message[user_id] = msg.message_id
+    bounded_put(_last_bot_message, user_id, msg.message_id, LAST_MESSAGE_MAX)
     return msg
 
 async def get_guardian_stats_cached(token_id: int) -> tuple[int, int]:
@@ -1250,8 +1939,8 @@ async def get_guardian_stats_cached(token_id: int) -> tuple[int, int]:
             return entry["protected"], entry["scans"]
     
     # Если в кеше нет или устарело – запрашиваем из контракта
-    protected = contract.functions.protectedAmount(token_id).call()
-    scans = contract.functions.scanCount(token_id).call()
+    protected = get_contract().functions.protectedAmount(token_id).call()
+    scans = get_contract().functions.scanCount(token_id).call()
     
     async with db_lock:
         if "guardian_stats_cache" not in db:
@@ -1261,7 +1950,7 @@ async def get_guardian_stats_cached(token_id: int) -> tuple[int, int]:
             "scans": scans,
             "ts": time.time()
         }
-    await save_db()  # можно сохранить, но не обязательно сразу
+    mark_db_dirty()  # можно сохранить, но не обязательно сразу
     return protected, scans
 
 async def get_status_text() -> str:
@@ -1311,7 +2000,7 @@ async def get_limit_text() -> str:
 # ИНЛАЙН-КЛАВИАТУРА ГЛАВНОГО МЕНЮ
 # ---------------------------------------------------------------------------
 
-def get_main_menu_keyboard():
+def _build_main_menu() -> types.InlineKeyboardMarkup:
     markup = types.InlineKeyboardMarkup(row_width=2)
     btn1 = types.InlineKeyboardButton("👛 Мои кошельки", callback_data="menu_mywallets")
     btn2 = types.InlineKeyboardButton("🔗 Подключить кошелёк", callback_data="menu_connect")
@@ -1324,6 +2013,14 @@ def get_main_menu_keyboard():
     return markup
 
 
+# Меню одинаковое для всех — собираем один раз. Вызывающие его не изменяют!
+_MAIN_MENU = _build_main_menu()
+
+
+def get_main_menu_keyboard() -> types.InlineKeyboardMarkup:
+    return _MAIN_MENU
+
+
 # ---------------------------------------------------------------------------
 # ОБРАБОТЧИКИ КОМАНД
 # ---------------------------------------------------------------------------
@@ -1364,7 +2061,7 @@ async def cmd_start(m: types.Message) -> None:
                 if uid_str not in db["bonus_flags"]:
                     db["bonus_flags"][uid_str] = []
                 db["bonus_flags"][uid_str].append("dashboard_bonus")
-                await save_db()
+                mark_db_dirty()
                 
                 # Отправляем приветственное сообщение о бонусе
                 await safe_send(
@@ -1387,12 +2084,9 @@ async def cmd_connect(m: types.Message) -> None:
     uid = m.from_user.id
     nonce = secrets.token_hex(16)
 
-    async with db_lock:
-        db["pending_verifications"][str(uid)] = {
-            "nonce": nonce,
-            "ts": time.time(),
-        }
-    await save_db()
+    async with user_lock(uid):
+        set_pending_verification(uid, nonce)
+    mark_user_dirty("pending_verifications", str(uid))
 
     # Формируем URL с параметрами startapp и wc_project_id
     parts = [f"startapp={nonce}", f"wc_project_id={REOWN_PROJECT_ID}"]
@@ -1461,12 +2155,9 @@ async def handle_menu_callback(c: types.CallbackQuery):
         # Генерируем nonce и редактируем текущее сообщение
         await bot.answer_callback_query(c.id)
         nonce = secrets.token_hex(16)
-        async with db_lock:
-            db["pending_verifications"][str(user_id)] = {
-                "nonce": nonce,
-                "ts": time.time(),
-            }
-        await save_db()
+        async with user_lock(user_id):
+            set_pending_verification(user_id, nonce)
+        mark_user_dirty("pending_verifications", str(user_id))
         parts = [f"startapp={nonce}", f"wc_project_id={REOWN_PROJECT_ID}"]
         if BOT_PUBLIC_URL:
             parts.append(f"api={BOT_PUBLIC_URL}/webapp/connect")
@@ -1500,7 +2191,7 @@ async def handle_menu_callback(c: types.CallbackQuery):
         await send_and_clean(message.chat.id, "Отправь адрес контракта для проверки:", user_id=user_id)
     elif action == "settings":
         await bot.answer_callback_query(c.id)
-        async with db_lock:
+        async with user_lock(user_id):
             user_limit = db.get("user_limits", {}).get(str(user_id), db["cfg"]["limit_usd"])
         
         set_state(user_id, "wait_limit")
@@ -1537,7 +2228,7 @@ async def cb_disconnect(c: types.CallbackQuery) -> None:
         await bot.answer_callback_query(c.id, "⛔ Нет доступа", show_alert=True)
         return
 
-    async with db_lock:
+    async with user_lock(c.from_user.id):
         wallets = db["connected_wallets"].get(str(c.from_user.id), [])
         if idx >= len(wallets):
             await bot.answer_callback_query(c.id, "Кошелёк не найден")
@@ -1546,10 +2237,10 @@ async def cb_disconnect(c: types.CallbackQuery) -> None:
         if not wallets:
             del db["connected_wallets"][str(c.from_user.id)]
 
-    await save_db()
+    mark_user_dirty("connected_wallets", str(c.from_user.id))
     await bot.answer_callback_query(c.id, "✅ Кошелёк отключён")
     await bot.edit_message_text(
-        f"✅ Кошелёк отключён:\n<code>{esc(removed['address'])}</code>",
+        f"✅ Кошелёк отключён:\n<code>{esc_addr(removed['address'])}</code>",
         c.message.chat.id,
         c.message.message_id,
     )
@@ -1589,7 +2280,7 @@ async def handle_webapp_data(m: types.Message) -> None:
     logger.info(f"� Получены данные WebApp от user_id={uid}")
     
     try:
-        data = json.loads(m.web_app_data.data)
+        data = orjson.loads(m.web_app_data.data)
         address = data.get("address", "").strip()
         sig = data.get("signature", "").strip()
         nonce = data.get("nonce", "").strip()
@@ -1614,7 +2305,7 @@ async def handle_webapp_data(m: types.Message) -> None:
         await safe_send(
             uid,
             f"✅ <b>Кошелёк подключён!</b>\n"
-            f"<code>{esc(address.lower())}</code>\n\n"
+            f"<code>{esc_addr(address.lower())}</code>\n\n"
             f"Теперь ты получаешь личные алерты о всех транзакциях этого адреса.",
         )
         
@@ -1641,7 +2332,7 @@ async def handle_webapp_data(m: types.Message) -> None:
                 db["user_guardians"][str(uid)] = token_id
                 logger.info(f"💾 token_id={token_id} сохранён в БД для user_id={uid}")
             
-            await save_db()
+            mark_db_dirty()
             logger.info(f"🎉 Guardian NFT успешно заминчен и сохранён для user_id={uid}")
         except Exception as e:
             logger.error(f"❌ Ошибка минта Guardian для user_id={uid}: {e}", exc_info=True)
@@ -1658,7 +2349,7 @@ async def handle_webapp_data(m: types.Message) -> None:
 @bot.message_handler(commands=["mywallets"])
 async def cmd_mywallets(m: types.Message) -> None:
     uid = m.from_user.id
-    async with db_lock:
+    async with user_lock(uid):
         wallets = list(db["connected_wallets"].get(str(uid), []))
 
     if not wallets:
@@ -1677,7 +2368,7 @@ async def cmd_mywallets(m: types.Message) -> None:
         limit = db["cfg"]["limit_usd"]
 
     lines = "\n".join(
-        f"{i+1}. <b>{esc(w['label'])}</b>\n   <code>{esc(w['address'])}</code>"
+        f"{i+1}. <b>{esc(w['label'])}</b>\n   <code>{esc_addr(w['address'])}</code>"
         for i, w in enumerate(wallets)
     )
 
@@ -1748,13 +2439,19 @@ Token ID: <code>{token_id}</code>
 💰 Защищено: <b>${protected_usd:,.2f}</b>
 📊 Сканов сделано: <b>{scans:,}</b>
 
-🔗 <a href="https://opbnbscan.com/token/{os.getenv('NFA_CONTRACT_ADDRESS')}?a={token_id}">Посмотреть на opbnbscan</a>
+🔗 <a href="https://opbnbscan.com/token/{NFA_ADDRESS}?a={token_id}">Посмотреть на opbnbscan</a>
 """
 
     kb = types.InlineKeyboardMarkup()
     kb.add(types.InlineKeyboardButton("🔄 Обновить данные", callback_data="refresh_guardian"))
 
-    await send_and_clean(m.chat.id, text, reply_markup=kb, user_id=m.from_user.id)
+    msg = await send_and_clean(m.chat.id, text, reply_markup=kb, user_id=m.from_user.id)
+    bounded_put(
+        _guardian_last_rendered,
+        (m.chat.id, msg.message_id),
+        (protected, scans, token_id),
+        GUARDIAN_RENDER_CACHE_MAX,
+    )
 
 
 # Callback для кнопки "Обновить данные"
@@ -1768,8 +2465,8 @@ async def cb_refresh_guardian(c: types.CallbackQuery):
         return
     try:
         # Принудительно запрашиваем из контракта и обновляем кеш
-        protected = contract.functions.protectedAmount(token_id).call()
-        scans = contract.functions.scanCount(token_id).call()
+        protected = get_contract().functions.protectedAmount(token_id).call()
+        scans = get_contract().functions.scanCount(token_id).call()
         
         # Обновляем кеш
         async with db_lock:
@@ -1780,6 +2477,13 @@ async def cb_refresh_guardian(c: types.CallbackQuery):
                 "scans": scans,
                 "ts": time.time()
             }
+
+        # Значения не изменились — не тратим запрос edit_message_text к Telegram
+        render_key = (c.message.chat.id, c.message.message_id)
+        rendered = (protected, scans, token_id)
+        if _guardian_last_rendered.get(render_key) == rendered:
+            await bot.answer_callback_query(c.id, "✅ Данные актуальны", show_alert=False)
+            return
         
         protected_usd = protected / 1_000_000
         text = f"""
@@ -1790,12 +2494,13 @@ Token ID: <code>{token_id}</code>
 💰 Защищено: <b>${protected_usd:,.2f}</b>
 📊 Сканов сделано: <b>{scans:,}</b>
 
-🔗 <a href="https://opbnbscan.com/token/{os.getenv('NFA_CONTRACT_ADDRESS')}?a={token_id}">Посмотреть на opbnbscan</a>
+🔗 <a href="https://opbnbscan.com/token/{NFA_ADDRESS}?a={token_id}">Посмотреть на opbnbscan</a>
 """
         kb = types.InlineKeyboardMarkup()
         kb.add(types.InlineKeyboardButton("🔄 Обновить данные", callback_data="refresh_guardian"))
         try:
             await bot.edit_message_text(text, c.message.chat.id, c.message.message_id, reply_markup=kb, disable_web_page_preview=True)
+            bounded_put(_guardian_last_rendered, render_key, rendered, GUARDIAN_RENDER_CACHE_MAX)
             await bot.answer_callback_query(c.id, "✅ Данные обновлены")
         except Exception as e:
             if "message is not modified" in str(e):
@@ -1810,7 +2515,7 @@ Token ID: <code>{token_id}</code>
 @bot.message_handler(commands=["disconnect"])
 async def cmd_disconnect(m: types.Message) -> None:
     uid = m.from_user.id
-    async with db_lock:
+    async with user_lock(uid):
         wallets = list(db["connected_wallets"].get(str(uid), []))
 
     if not wallets:
@@ -1925,7 +2630,7 @@ async def cmd_check(m: types.Message) -> None:
 
     result_text = (
         f"{icon} <b>Проверка контракта</b>\n"
-        f"<code>{esc(addr)}</code>\n\n"
+        f"<code>{esc_addr(addr)}</code>\n\n"
         f"🛡️ <b>VibeScore: {score}/100</b> ({'Безопасно' if is_safe else 'Риск'})\n"
         f"<b>Статус:</b> {esc(status)}\n"
         f"<b>Вердикт AI:</b> {verdict_text} (уверенность: {confidence:.0%})\n"
@@ -1985,37 +2690,30 @@ async def perform_audit(addr: str, chat_id: int, reply_to_message_id: int = None
         status_msg.message_id
     )
     
-    # 2. Формируем промпт
-    prompt = f"""
-    Ты - эксперт по безопасности Solidity. Проанализируй этот код контракта на наличие бэкдоров:
-    {code[:15000]}
-
-    Найди: 
-    1. Функции Mint (печать новых токенов).
-    2. Функции Pause (остановка торгов).
-    3. Скрытую смену владельца.
-    4. Логику Honeypot.
-
-    Ответь в формате JSON со следующими полями:
-    - verdict: одно из ["SAFE", "WARNING", "DANGER"] (SAFE = безопасно, WARNING = есть сомнения, DANGER = опасно)
-    - confidence: число от 0 до 1, где 1 = полная уверенность
-    - risk_factors: массив строк, описывающих найденные угрозы (например, ["mint function", "pause", "hidden owner"]). Если угроз нет, массив пустой.
-    - explanation: краткое пояснение для пользователя на русском (2-3 предложения)
-
-    Только JSON, без дополнительного текста.
-    """
-    
-    # 3. Зовём AI
-    async with ai_sem:
-        verdict = await call_ai(prompt)
-    
-    # 4. Сохраняем в кеш
+    # 2. Тот же исходный код (другой регистр адреса, прокси) уже проверяли?
+    code_hash = hashlib.sha256(code.encode()).hexdigest()
     async with db_lock:
-        db.setdefault("audit_cache", {})[addr.lower()] = {
+        by_hash = db.setdefault("audit_cache_by_hash", {}).get(code_hash)
+    if by_hash and time.time() - by_hash["timestamp"] < AUDIT_CACHE_TTL:
+        entry = by_hash
+    else:
+        # 3. Формируем промпт и зовём AI
+        # code уже обрезан до SOURCE_CODE_MAX_LEN в fetch_source_code
+        prompt = AUDIT_PROMPT_HEAD + code + AUDIT_PROMPT_TAIL
+
+        async with ai_sem:
+            verdict = await call_ai(prompt)
+        entry = {
             "result": verdict,  # теперь verdict — это словарь
             "timestamp": time.time()
         }
-    await save_db()
+    verdict = entry["result"]
+    
+    # 4. Сохраняем в кеш (по адресу и по хешу кода)
+    async with db_lock:
+        db.setdefault("audit_cache", {})[addr.lower()] = entry
+        db.setdefault("audit_cache_by_hash", {})[code_hash] = entry
+    mark_db_dirty()
     
     # 5. Формируем финальный отчёт из структурированного ответа
     verdict_text = verdict.get("verdict", "WARNING")
@@ -2109,8 +2807,8 @@ async def cmd_limit(m: types.Message, delete_previous: types.Message = None) ->
             async with db_lock:
                 db["cfg"]["limit_usd"] = v
                 logger.info(f"🔍 /limit: внутри db_lock значение установлено = {db['cfg']['limit_usd']}")
-            await save_db()
-            logger.info(f"🔍 /limit: после save_db, значение в db = {db['cfg']['limit_usd']}")
+            mark_db_dirty()
+            logger.info(f"🔍 /limit: сохранение запланировано, значение в db = {db['cfg']['limit_usd']}")
             await send_and_clean(m.chat.id, f"✅ Лимит китов изменён: <b>${v:,.0f}</b>", user_id=m.from_user.id)
         except ValueError:
             await send_and_clean(m.chat.id, f"❌ Укажите число от {LIMIT_MIN_USD:.0f}. Пример: /limit 100", user_id=m.from_user.id)
@@ -2136,7 +2834,7 @@ async def cmd_debug_limit(m: types.Message):
             async with pool.acquire() as conn:
                 row = await conn.fetchrow("SELECT data FROM bot_data WHERE id = 1")
                 if row:
-                    data = json.loads(row['data'])
+                    data = row['data']
                     db_limit = data.get("cfg", {}).get("limit_usd")
         except Exception as e:
             db_limit = f"Ошибка: {e}"
@@ -2166,8 +2864,8 @@ async def cmd_set_limit_test(m: types.Message):
             old = db["cfg"]["limit_usd"]
             db["cfg"]["limit_usd"] = new_limit
             logger.info(f"🧪 Тестовый лимит в памяти изменён с {old} на {new_limit}")
-        await save_db()
-        await send_and_clean(m.chat.id, f"✅ Лимит в памяти установлен: {new_limit}, БД сохранена", user_id=m.from_user.id)
+        mark_db_dirty()
+        await send_and_clean(m.chat.id, f"✅ Лимит в памяти установлен: {new_limit}, сохранение в БД запланировано", user_id=m.from_user.id)
     except Exception as e:
         await send_and_clean(m.chat.id, f"Ошибка: {e}", user_id=m.from_user.id)
 
@@ -2206,13 +2904,13 @@ async def cmd_watch(m: types.Message) -> None:
     if len(args) < 2:
         await send_and_clean(m.chat.id, "Пример: /watch 0xADDRESS", user_id=m.from_user.id); return
     addr = args[1].lower()
-    if not Web3.is_address(addr):
+    if not is_addr_fast(addr):
         await send_and_clean(m.chat.id, "❌ Невалидный адрес", user_id=m.from_user.id); return
     async with db_lock:
         if addr not in db["cfg"]["watch"]:
             db["cfg"]["watch"].append(addr)
-    await save_db()
-    await send_and_clean(m.chat.id, f"✅ Watchlist:\n<code>{esc(addr)}</code>", user_id=m.from_user.id)
+    mark_db_dirty()
+    await send_and_clean(m.chat.id, f"✅ Watchlist:\n<code>{esc_addr(addr)}</code>", user_id=m.from_user.id)
 
 
 @bot.message_handler(commands=["unwatch"])
@@ -2226,7 +2924,7 @@ async def cmd_unwatch(m: types.Message) -> None:
         found = addr in db["cfg"]["watch"]
         if found: db["cfg"]["watch"].remove(addr)
     if found:
-        await save_db()
+        mark_db_dirty()
         await send_and_clean(m.chat.id, f"✅ Удалён из watchlist:\n<code>{esc(addr)}</code>", user_id=m.from_user.id)
     else:
         await send_and_clean(m.chat.id, "Адрес не найден в watchlist", user_id=m.from_user.id)
@@ -2239,13 +2937,13 @@ async def cmd_ignore(m: types.Message) -> None:
     if len(args) < 2:
         await send_and_clean(m.chat.id, "Пример: /ignore 0xADDRESS", user_id=m.from_user.id); return
     addr = args[1].lower()
-    if not Web3.is_address(addr):
+    if not is_addr_fast(addr):
         await send_and_clean(m.chat.id, "❌ Невалидный адрес", user_id=m.from_user.id); return
     async with db_lock:
         if addr not in db["cfg"]["ignore"]:
             db["cfg"]["ignore"].append(addr)
-    await save_db()
-    await send_and_clean(m.chat.id, f"✅ Ignore:\n<code>{esc(addr)}</code>", user_id=m.from_user.id)
+    mark_db_dirty()
+    await send_and_clean(m.chat.id, f"✅ Ignore:\n<code>{esc_addr(addr)}</code>", user_id=m.from_user.id)
 
 
 @bot.message_handler(commands=["unignore"])
@@ -2259,7 +2957,7 @@ async def cmd_unignore(m: types.Message) -> None:
         found = addr in db["cfg"]["ignore"]
         if found: db["cfg"]["ignore"].remove(addr)
     if found:
-        await save_db()
+        mark_db_dirty()
         await send_and_clean(m.chat.id, f"✅ Удалён из ignore:\n<code>{esc(addr)}</code>", user_id=m.from_user.id)
     else:
         await send_and_clean(m.chat.id, "Адрес не найден", user_id=m.from_user.id)
@@ -2302,6 +3000,7 @@ async def graceful_shutdown(sig_name: str) -> None:
     global _shutdown
     logger.info(f"🛑 {sig_name} — начинаем завершение...")
     _shutdown = True
+    _shutdown_event.set()
 
     try:
         await asyncio.wait_for(
@@ -2312,8 +3011,15 @@ async def graceful_shutdown(sig_name: str) -> None:
     except asyncio.TimeoutError:
         logger.warning("⚠️  Очереди не опустели за 30 сек — принудительно")
 
-    await save_db()
+    # Финальная запись — не ждём _db_flusher. Сначала гасим его: прерванная
+    # запись вернёт свои ключи в _dirty_rows, и их подхватит flush_db ниже
+    if _flusher_task is not None and not _flusher_task.done():
+        _flusher_task.cancel()
+        await asyncio.gather(_flusher_task, return_exceptions=True)
+    _db_dirty.clear()
+    await flush_db(force_blob=True)
     logger.info("✅ БД сохранена")
+    shutdown_mint_executor()
 
     for task in _main_tasks:
         if not task.done():
@@ -2327,7 +3033,11 @@ async def graceful_shutdown(sig_name: str) -> None:
 async def scan_approvals(address: str) -> list[dict]:
     """Сканирует approve разрешения для адреса"""
     try:
-        # Получаем все трансферы токенов (ERC20 Transfer)
+        # Адрес пользователя в виде 32-байтного topic — сравниваем topics целиком,
+        # без нарезки и .lower() на каждый лог (RPC отдаёт hex в нижнем регистре)
+        user_topic = "0x" + "0" * 24 + address.lower()[2:]
+
+        # Получаем трансферы токенов (ERC20 Transfer), сразу отбрасывая чужие
         logs = await rpc({
             "jsonrpc": "2.0",
             "method": "eth_getLogs",
@@ -2342,17 +3052,12 @@ async def scan_approvals(address: str) -> list[dict]:
                 ]
             }],
             "id": 1
-        })
+        }, keep=lambda log: len(log.get("topics", ())) >= 3 and log["topics"][2] == user_topic)
+        if "error" in logs:
+            raise RuntimeError(f"eth_getLogs: {logs['error']}")
         
-        # Находим токены, которыми владел пользователь
-        user_tokens = set()
-        for log in logs.get("result", []):
-            topics = log.get("topics", [])
-            if len(topics) >= 3:
-                to_addr = "0x" + topics[2][-40:]  # Получаем to адрес из topic2
-                if to_addr.lower() == address.lower():
-                    token_addr = log.get("address", "")
-                    user_tokens.add(token_addr.lower())
+        # Находим токены, которыми владел пользователь (to = topic2)
+        user_tokens = {log.get("address", "").lower() for log in logs["result"]}
         
         # Теперь сканируем approve для этих токенов
         approvals = []
@@ -2378,10 +3083,8 @@ async def scan_approvals(address: str) -> list[dict]:
                 for log in approve_logs.get("result", []):
                     topics = log.get("topics", [])
                     if len(topics) >= 3:
-                        owner = "0x" + topics[1][-40:]
-                        spender = "0x" + topics[2][-40:]
-                        
-                        if owner.lower() == address.lower():
+                        if topics[1] == user_topic:  # owner (topic1)
+                            spender = "0x" + topics[2][-40:]
                             # Получаем данные из log.data
                             data = log.get("data", "0x")
                             if len(data) >= 66:  # 0x + 32 bytes
@@ -2485,7 +3188,7 @@ async def get_token_info(token_addr: str) -> dict:
 def format_amount(amount: int, decimals: int) -> str:
     """Форматирует количество токенов"""
     try:
-        if amount == 115792089237316195423570985008687907853269984665640564039457584007913129639935:
+        if amount == MAX_UINT256:
             return "Unlimited"
         
         value = amount / (10 ** decimals)
@@ -2504,29 +3207,40 @@ def format_amount(amount: int, decimals: int) -> str:
 # HEALTH SERVER (POST /webapp/connect)
 # ---------------------------------------------------------------------------
 
+# Общие для всех ответов health-сервера; собираются один раз при импорте
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Max-Age": "86400",
+}
+_HEALTH_OK_BODY = b"ok"
+
 async def _run_health_server() -> None:
     logger.info("🚀 _run_health_server: попытка запуска...")
     try:
         from aiohttp import web
         port = int(os.getenv("PORT", "8080"))
         logger.info(f"🔄 _run_health_server: порт {port}")
-        cors_headers = {
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type",
-            "Access-Control-Max-Age": "86400",
-        }
+        def json_response(payload, status: int = 200):
+            # orjson вместо web.json_response (stdlib json)
+            return web.Response(
+                body=orjson.dumps(payload),
+                status=status,
+                content_type="application/json",
+                headers=CORS_HEADERS,
+            )
 
         async def handle(_):
-            return web.Response(text="ok", headers=cors_headers)
+            return web.Response(body=_HEALTH_OK_BODY, headers=CORS_HEADERS)
 
         async def handle_webapp_connect(request):
             logger.info(f"📥 POST /webapp/connect вызван от {request.remote}")
             try:
-                payload = await request.json()
+                payload = orjson.loads(await request.read())
             except Exception:
                 logger.warning("❌ Ошибка парсинга JSON в /webapp/connect")
-                return web.json_response({"ok": False, "error": "bad json"}, status=400, headers=cors_headers)
+                return json_response({"ok": False, "error": "bad json"}, status=400)
 
             nonce = str(payload.get("nonce", "")).strip()
             address = str(payload.get("address", "")).strip()
@@ -2535,30 +3249,23 @@ async def _run_health_server() -> None:
 
             if not nonce or not address or not signature:
                 logger.warning("❌ Отсутствуют обязательные поля в /webapp/connect")
-                return web.json_response({"ok": False, "error": "missing fields"}, status=400, headers=cors_headers)
+                return json_response({"ok": False, "error": "missing fields"}, status=400)
 
-            uid: Optional[int] = None
-            async with db_lock:
-                for uid_str, p in db.get("pending_verifications", {}).items():
-                    if str(p.get("nonce", "")) == nonce:
-                        try:
-                            uid = int(uid_str)
-                        except Exception:
-                            uid = None
-                        break
+            # Одиночное чтение dict без await — db_lock не нужен (см. set_pending_verification)
+            uid: Optional[int] = db.get("nonce_index", {}).get(nonce)
 
             logger.info(f"🔍 handle_webapp_connect: найден uid из nonce: {uid}")
 
             if uid is None:
                 logger.warning(f"❌ Сессия не найдена для nonce={nonce[:8]}...")
-                return web.json_response({"ok": False, "error": "session not found"}, status=404, headers=cors_headers)
+                return json_response({"ok": False, "error": "session not found"}, status=404)
 
             success, message = await verify_wallet(uid, address, signature)
             if success:
                 await safe_send(
                     uid,
                     f"✅ <b>Кошелёк подключён!</b>\n"
-                    f"<code>{esc(address.lower())}</code>\n\n"
+                    f"<code>{esc_addr(address.lower())}</code>\n\n"
                     f"Теперь ты получаешь личные алерты о всех транзакциях "
                     f"этого адреса.",
                 )
@@ -2566,30 +3273,30 @@ async def _run_health_server() -> None:
                 logger.info(f"🔍 Запускаем mint_guardian_for_user с uid={uid}")
                 asyncio.create_task(mint_guardian_for_user(uid))
                 logger.info(f"✅ Кошелёк подключен и минт Guardian запущен для user_id={uid}")
-                return web.json_response({"ok": True}, headers=cors_headers)
+                return json_response({"ok": True})
 
-            return web.json_response({"ok": False, "error": str(message)[:200]}, status=400, headers=cors_headers)
+            return json_response({"ok": False, "error": str(message)[:200]}, status=400)
 
         async def handle_approvals(request):
             logger.info(f"📥 {request.method} /webapp/approvals вызван от {request.remote}")
             address = None
             if request.method == "POST":
                 try:
-                    data = await request.json()
+                    data = orjson.loads(await request.read())
                     address = data.get("address")
                 except: pass
             elif request.method == "GET":
                 address = request.query.get("address")
         
-            if not address or not Web3.is_address(address):
+            if not address or not is_addr_fast(address):
                 logger.warning(f"❌ Невалидный адрес: {address}")
-                return web.json_response({"ok": False, "error": "Invalid address"}, headers=cors_headers)
+                return json_response({"ok": False, "error": "Invalid address"})
 
             try:
                 # Используем GoPlus (Сеть 204 = opBNB)
                 url = f"https://api.gopluslabs.io/api/v1/token_approvals?chain_id=204&user_address={address}"
                 async with http_session.get(url, timeout=10) as resp:
-                    data = await resp.json()
+                    data = orjson.loads(await resp.read())
                     raw_approvals = data.get("result", [])
                     
                     clean_approvals = []
@@ -2607,16 +3314,16 @@ async def _run_health_server() -> None:
                                     "risk": "high" if spender.get("is_danger") == 1 else "low"
                                 })
                     logger.info(f"✅ Найдено {len(clean_approvals)} approvals для {address[:8]}...")
-                    return web.json_response({"ok": True, "approvals": clean_approvals}, headers=cors_headers)
+                    return json_response({"ok": True, "approvals": clean_approvals})
             except Exception as e:
                 logger.error(f"❌ Ошибка в /webapp/approvals: {e}")
-                return web.json_response({"ok": False, "error": str(e)}, headers=cors_headers)
+                return json_response({"ok": False, "error": str(e)})
 
         async def handle_webapp_approvals(request):
             return await handle_approvals(request)
 
         async def handle_webapp_connect_options(_):
-            return web.Response(headers=cors_headers)
+            return web.Response(headers=CORS_HEADERS)
 
         async def handle_stats(request):
             """Возвращает общую статистику бота для дашборда"""
@@ -2635,7 +3342,7 @@ async def _run_health_server() -> None:
                     "bnb_price": _price_cache.get("BNB", 0),
                     "total_analyzed_usd": db.get("total_analyzed_usd", 0.0)
                 }
-            return web.json_response(stats, headers=cors_headers)
+            return json_response(stats)
 
         async def handle_global(request):
             """Глобальные метрики: общая защищённая сумма (в долларах)"""
@@ -2644,13 +3351,13 @@ async def _run_health_server() -> None:
             # Для производительности можно закешировать, но пока делаем простой вариант
             for token_id in db.get("user_guardians", {}).values():
                 try:
-                    protected = contract.functions.protectedAmount(token_id).call()
+                    protected = get_contract().functions.protectedAmount(token_id).call()
                     total_protected += protected
                 except Exception as e:
                     logger.warning(f"Не удалось получить protectedAmount для token {token_id}: {e}")
             # protectedAmount хранится с 6 десятичными знаками (как в вашем коде)
             total_protected_usd = total_protected / 1_000_000
-            return web.json_response({"total_protected_usd": total_protected_usd}, headers=cors_headers)
+            return json_response({"total_protected_usd": total_protected_usd})
 
         logger.info("🔧 Создание приложения и регистрация роутов...")
         app = web.Application()
@@ -2663,15 +3370,15 @@ async def _run_health_server() -> None:
         app.router.add_get("/api/global", handle_global)
         
         logger.info("🚀 Запуск AppRunner и TCPSite...")
-        runner = web.AppRunner(app)
+        # access_log=None: не форматируем строку лога на каждый запрос (healthcheck дёргается постоянно)
+        runner = web.AppRunner(app, access_log=None)
         await runner.setup()
         site = web.TCPSite(runner, host="0.0.0.0", port=port)
         await site.start()
         logger.info(f"✅ Health server listening on 0.0.0.0:{port}")
 
         try:
-            while not _shutdown:
-                await asyncio.sleep(1)
+            await _shutdown_event.wait()
         finally:
             await runner.cleanup()
             logger.info("✅ Health server stopped")
@@ -2686,7 +3393,7 @@ async def _run_health_server() -> None:
 # ---------------------------------------------------------------------------
 
 async def main() -> None:
-    global http_session
+    global http_session, _flusher_task
 
     loop = asyncio.get_event_loop()
     for sig in (signal.SIGTERM, signal.SIGINT):
@@ -2711,9 +3418,25 @@ async def main() -> None:
             if attempt < 2:
                 await asyncio.sleep(3)
 
-    # HTTP сессия
-    connector    = aiohttp.TCPConnector(limit=50, ttl_dns_cache=300)
-    http_session = aiohttp.ClientSession(connector=connector)
+    # HTTP сессия — одна на весь процесс (RPC, GoPlus, explorer, AI, CoinGecko),
+    # keep-alive пул избавляет от TCP+TLS рукопожатия на каждый запрос
+    # TCP_NODELAY aiohttp ставит сам на каждое соединение (клиент и web-сервер),
+    # поэтому мелкие JSON-запросы к RPC/AI не ждут Nagle + delayed ACK
+    connector    = aiohttp.TCPConnector(
+        limit=200,
+        limit_per_host=32,  # RPC, GoPlus, CoinGecko, AI — разные хосты не душат друг друга
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+        force_close=False,
+        enable_cleanup_closed=True,
+    )
+    http_session = aiohttp.ClientSession(
+        connector=connector,
+        # connect=3: мёртвый узел отваливается быстро, не съедая весь total
+        timeout=aiohttp.ClientTimeout(total=15, connect=3),
+        # json=... в запросах кодируется через orjson
+        json_serialize=lambda obj: orjson.dumps(obj).decode(),
+    )
 
     # Health сервер для /webapp/connect
     health_task = asyncio.create_task(_run_health_server())
@@ -2747,25 +3470,35 @@ async def main() -> None:
         bot.infinity_polling(allowed_updates=["message", "callback_query"])
     )
     monitor_task = asyncio.create_task(monitor())
+    flusher_task = _flusher_task = asyncio.create_task(_db_flusher())
+    prices_task  = asyncio.create_task(refresh_prices_loop())
+    sweeper_task = asyncio.create_task(_cache_sweeper())
     tx_workers   = [asyncio.create_task(tx_worker(i))  for i in range(6)]
     log_workers  = [asyncio.create_task(log_worker(i)) for i in range(4)]
 
-    _main_tasks.extend([polling_task, monitor_task, health_task])
+    _main_tasks.extend([
+        polling_task, monitor_task, health_task, flusher_task, prices_task, sweeper_task,
+    ])
 
     try:
         await asyncio.gather(
             polling_task,
             monitor_task,
             health_task,
+            flusher_task,
+            prices_task,
+            sweeper_task,
             *tx_workers,
             *log_workers,
             return_exceptions=True,
         )
     finally:
         _shutdown = True
+        _shutdown_event.set()
         for t in tx_workers + log_workers:
             t.cancel()
-        await save_db()
+        await flush_db(force_blob=True)
+        shutdown_mint_executor()
         if http_session and not http_session.closed:
             await http_session.close()
         if pool:
@@ -2777,7 +3510,7 @@ async def main() -> None:
 async def handle_limit_input(m: types.Message) -> None:
     uid = m.from_user.id
     try:
-        val = float(m.text.strip().replace("$", "").replace(",", ""))
+        val = parse_amount(m.text)
         min_allowed = 1.0 if is_owner(uid) else 3000.0
         
         if val < min_allowed:
@@ -2789,16 +3522,16 @@ async def handle_limit_input(m: types.Message) -> None:
             async with db_lock:
                 db["cfg"]["limit_usd"] = val
                 logger.info(f"🔧 Глобальный лимит изменён через настройки на {val}")
-            await save_db()
+            mark_db_dirty()
             clear_state(uid)
             await send_and_clean(m.chat.id, f"✅ Глобальный лимит китов изменён: <b>${val:,.0f}</b>", reply_markup=get_main_menu_keyboard(), user_id=m.from_user.id)
         else:
             # Для обычных пользователей сохраняем персональный лимит
-            async with db_lock:
+            async with user_lock(uid):
                 if "user_limits" not in db:
                     db["user_limits"] = {}
                 db["user_limits"][str(uid)] = val
-            await save_db()
+            mark_user_dirty("user_limits", str(uid))
             clear_state(uid)
             await send_and_clean(m.chat.id, f"✅ Твой личный лимит установлен: <b>${val:,.0f}</b>", reply_markup=get_main_menu_keyboard(), user_id=m.from_user.id)
     except ValueError:
@@ -2806,4 +3539,8 @@ async def handle_limit_input(m: types.Message) -> None:
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            runner.run(main())
+    else:
+        asyncio.run(main())
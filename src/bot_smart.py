@@ -148,13 +148,15 @@ if not WEBAPP_URL:
 # СТРУКТУРА БД И ГЛОБАЛЬНЫЕ ОБЪЕКТЫ
 # ---------------------------------------------------------------------------
 
-_DB_DEFAULT: dict = {
-    "stats": {"blocks": 0, "whales": 0, "threats": 0},
-    "cfg":   {"limit_usd": 10_000.0, "watch": [], "ignore": []},
-    "last_block": 0,
-    "connected_wallets": {},
-    "pending_verifications": {},
-}
+def _make_default_db() -> dict:
+    """Свежая БД по умолчанию — литерал вместо copy.deepcopy"""
+    return {
+        "stats": {"blocks": 0, "whales": 0, "threats": 0},
+        "cfg":   {"limit_usd": 10_000.0, "watch": [], "ignore": []},
+        "last_block": 0,
+        "connected_wallets": {},
+        "pending_verifications": {},
+    }
 
 db: dict = {}
 
@@ -221,41 +223,45 @@ def create_action_id(action_type: str, target: str) -> str:
 async def require_multisig(action_type: str, target: str, initiator: int) -> tuple[bool, str]:
     if len(OWNERS) == 1:
         return True, "Одиночный владелец - действие выполнено"
+    if MULTISIG_THRESHOLD <= 1:
+        # Подтверждения инициатора уже достаточно — pending-запись и запись в БД не нужны
+        return True, f"Действие подтверждено (1/{MULTISIG_THRESHOLD})"
     
     action_id = create_action_id(action_type, target)
     
-    async with db_lock:
-        _pending_actions[action_id] = {
-            "type": action_type,
-            "target": target,
-            "initiator": initiator,
-            "confirmations": {initiator},
-            "required": MULTISIG_THRESHOLD,
-            "ts": time.time()
-        }
+    # Между чтением и записью нет await — в одном event loop это и так атомарно
+    _pending_actions[action_id] = {
+        "type": action_type,
+        "target": target,
+        "initiator": initiator,
+        "confirmations": {initiator},
+        "required": MULTISIG_THRESHOLD,
+        "ts": time.time()
+    }
     
     await save_db()
     return False, f"Требуется {MULTISIG_THRESHOLD} подтверждений. Получено: 1/{MULTISIG_THRESHOLD}"
 
 async def confirm_action(action_id: str, user_id: int) -> tuple[bool, str]:
-    async with db_lock:
-        action = _pending_actions.get(action_id)
-        if not action:
-            return False, "Действие не найдено"
-        
-        if user_id in action["confirmations"]:
-            return False, "Вы уже подтвердили это действие"
-        
-        action["confirmations"].add(user_id)
-        
-        if len(action["confirmations"]) >= action["required"]:
-            # Достаточно подтверждений - выполняем действие
-            del _pending_actions[action_id]
-            await save_db()
-            return True, f"Действие подтверждено ({len(action['confirmations'])}/{action['required']})"
-        
-        await save_db()
-        return False, f"Подтверждено: {len(action['confirmations'])}/{action['required']}"
+    action = _pending_actions.get(action_id)
+    if not action:
+        return False, "Действие не найдено"
+    
+    if user_id in action["confirmations"]:
+        return False, "Вы уже подтвердили это действие"
+    
+    action["confirmations"].add(user_id)
+    confirmed = len(action["confirmations"])
+    done = confirmed >= action["required"]
+    if done:
+        # Достаточно подтверждений - выполняем действие
+        del _pending_actions[action_id]
+
+    # До save_db нет ни одного await — лок не нужен
+    await save_db()
+    if done:
+        return True, f"Действие подтверждено ({confirmed}/{action['required']})"
+    return False, f"Подтверждено: {confirmed}/{action['required']}"
 
 def is_owner(uid: int) -> bool:
     return uid in OWNERS
@@ -276,17 +282,17 @@ async def init_db() -> None:
         if row:
             raw_data = row["data"]
             loaded = json.loads(raw_data) if isinstance(raw_data, str) else raw_data
-            db = {**_DB_DEFAULT, **loaded}
-            db["stats"] = {**_DB_DEFAULT["stats"], **loaded.get("stats", {})}
-            db["cfg"]   = {**_DB_DEFAULT["cfg"],   **loaded.get("cfg",   {})}
+            default = _make_default_db()
+            db = {**default, **loaded}
+            db["stats"] = {**default["stats"], **loaded.get("stats", {})}
+            db["cfg"]   = {**default["cfg"],   **loaded.get("cfg",   {})}
             if db["cfg"]["limit_usd"] < LIMIT_MIN_USD:
                 db["cfg"]["limit_usd"] = LIMIT_MIN_USD
             db.setdefault("connected_wallets", {})
             db.setdefault("pending_verifications", {})
             logger.info("✅ БД загружена")
         else:
-            import copy
-            db = copy.deepcopy(_DB_DEFAULT)
+            db = _make_default_db()
             await conn.execute(
                 "INSERT INTO bot_data (id, data) VALUES (1, $1)",
                 json.dumps(db),
@@ -363,15 +369,13 @@ async def verify_wallet(user_id: int, address: str, signature: str) -> tuple[boo
     if not Web3.is_address(address):
         return False, "Невалидный адрес кошелька"
 
-    async with db_lock:
-        pending = db["pending_verifications"].get(uid_str)
+    pending = db["pending_verifications"].get(uid_str)
 
     if not pending:
         return False, "Сессия верификации не найдена. Нажми Connect Wallet заново."
 
     if time.time() - pending["ts"] > STATE_TTL:
-        async with db_lock:
-            db["pending_verifications"].pop(uid_str, None)
+        db["pending_verifications"].pop(uid_str, None)
         return False, "Сессия истекла. Нажми Connect Wallet заново."
 
     nonce   = pending["nonce"]
@@ -440,15 +444,26 @@ async def test_smart_connection():
 
 async def main():
     """Основная функция с демонстрацией умного подключения"""
+    global http_session
     logger.info("🚀 VibeGuard Sentinel запускается...")
     
-    # Инициализация сессии
-    http_session = aiohttp.ClientSession()
+    # Инициализация сессии — в глобальную переменную, её использует rpc()
+    connector = aiohttp.TCPConnector(
+        limit=100,
+        limit_per_host=20,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True,
+    )
+    http_session = aiohttp.ClientSession(connector=connector)
     
-    # Тест умного подключения
-    await test_smart_connection()
-    
-    logger.info("✅ VibeGuard Sentinel готов к работе!")
+    try:
+        # Тест умного подключения
+        await test_smart_connection()
+        
+        logger.info("✅ VibeGuard Sentinel готов к работе!")
+    finally:
+        await http_session.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
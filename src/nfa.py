@@ -1,9 +1,23 @@
 # src/nfa.py
 import os
 import json
+import functools
+import threading
+import time
 import asyncio
+import orjson
 import logging
-from web3 import Web3
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+from web3 import AsyncHTTPProvider, AsyncWeb3, Web3, WebsocketProviderV2
+from web3.exceptions import TransactionNotFound
+from eth_abi import decode as abi_decode, encode as abi_encode
+from eth_utils import event_abi_to_log_topic, function_signature_to_4byte_selector
+from eth_account import Account
+from eth_account.datastructures import SignedTransaction
 from dotenv import load_dotenv
 from safe_eth.eth import EthereumClient
 from safe_eth.safe import Safe
@@ -15,50 +29,151 @@ load_dotenv()
 logger = logging.getLogger("vibeguard.nfa")
 
 # ---------------------------------------------------------------------------
-# УМНОЕ ПОДКЛЮЧЕНИЕ К БЛОКЧЕЙНУ (переиспользуем из bot.py)
+# УМНОЕ ПОДКЛЮЧЕНИЕ К БЛОКЧЕЙНУ (общее для nfa и bot.py)
 # ---------------------------------------------------------------------------
+class BatchHTTPProvider(Web3.HTTPProvider):
+    """
+    HTTPProvider, умеющий отправить несколько вызовов одним JSON-RPC батчем.
+    В web3 6.x нет batch_requests — шлём массив запросов сами через ту же сессию.
+    """
+
+    def __init__(self, endpoint_uri: str, request_kwargs: Optional[dict] = None,
+                 session: Optional[requests.Session] = None) -> None:
+        super().__init__(endpoint_uri, request_kwargs=request_kwargs, session=session)
+        self._session = session or requests.Session()
+
+    def make_batch_request(self, calls: list[tuple[str, list]]) -> list:
+        """Результаты в порядке calls; ошибка любого вызова — исключение"""
+        payload = [
+            {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+            for i, (method, params) in enumerate(calls)
+        ]
+        resp = self._session.post(self.endpoint_uri, data=orjson.dumps(payload),
+                                  **self.get_request_kwargs())
+        resp.raise_for_status()
+        replies = orjson.loads(resp.content)
+        # Узел без поддержки батчей отвечает одиночной ошибкой вместо массива
+        if not isinstance(replies, list) or len(replies) != len(calls):
+            raise ValueError(f"Узел не принял батч: {replies!r}")
+        replies.sort(key=lambda r: r.get("id", -1))
+        for reply in replies:
+            if "error" in reply:
+                raise ValueError(f"JSON-RPC error: {reply['error']}")
+        return [reply["result"] for reply in replies]
+
+def make_http_provider(url: str, timeout: float = 3) -> BatchHTTPProvider:
+    """
+    HTTPProvider с собственным пулом keep-alive соединений: TLS-рукопожатие
+    один раз на соединение, а не на каждый eth_* вызов. 429/5xx повторяем
+    с backoff; read=0 — не переотправляем запрос, который узел мог уже принять.
+    """
+    retry = Retry(
+        total=3, read=0, backoff_factor=0.2,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return BatchHTTPProvider(url, request_kwargs={'timeout': timeout}, session=session)
+
+def probe_w3(url: str) -> Optional[Web3]:
+    """Web3 для узла, если он отвечает, иначе None."""
+    try:
+        if url.startswith('http'):
+            provider = make_http_provider(url)
+        elif url.startswith('ws'):
+            provider = Web3.WebsocketProvider(url)
+        else:
+            return None
+        temp_w3 = Web3(provider)
+        if temp_w3.is_connected():
+            return temp_w3
+    except Exception as e:
+        logger.warning(f"⚠️ Узел {url} недоступен: {e}")
+    return None
+
 def get_smart_w3(url_string):
     """Умное подключение к блокчейну с автоматическим переключением"""
     urls = [u.strip() for u in url_string.split(",") if u.strip()]
-    for url in urls:
-        try:
-            if url.startswith('http'):
-                provider = Web3.HTTPProvider(url, request_kwargs={'timeout': 3})
-            elif url.startswith('ws'):
-                provider = Web3.WebsocketProvider(url)
-            else:
-                continue
-            temp_w3 = Web3(provider)
-            if temp_w3.is_connected():
-                logger.info(f"✅ Успешное подключение к блокчейну через: {url}")
+    # Опрашиваем все узлы параллельно и берём первый ответивший —
+    # мёртвый первый узел больше не стоит нам полного таймаута
+    pool_ex = ThreadPoolExecutor(max_workers=max(1, len(urls)))
+    try:
+        futures = {pool_ex.submit(probe_w3, url): url for url in urls}
+        for fut in as_completed(futures):
+            temp_w3 = fut.result()
+            if temp_w3 is not None:
+                logger.info(f"✅ Успешное подключение к блокчейну через: {futures[fut]}")
                 return temp_w3
-        except Exception as e:
-            logger.warning(f"⚠️ Узел {url} недоступен: {e}")
-            continue
+    finally:
+        # Не ждём медленные узлы — их проверки доживут в фоне
+        pool_ex.shutdown(wait=False, cancel_futures=True)
     raise Exception("❌ КРИТИЧЕСКАЯ ОШИБКА: Ни один из RPC-узлов не отвечает!")
 
+# ---------------------------------------------------------------------------
+# ABI КОНТРАКТА
+# ---------------------------------------------------------------------------
+# Минимальный ABI на случай битой кодировки файла
+_FALLBACK_ABI = [
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "address", "name": "owner", "type": "address"},
+            {"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"},
+            {"indexed": False, "internalType": "string", "name": "name", "type": "string"}
+        ],
+        "name": "GuardianMinted",
+        "type": "event"
+    },
+    {
+        "inputs": [
+            {"internalType": "string", "name": "name", "type": "string"},
+            {"internalType": "string", "name": "imageURI", "type": "string"}
+        ],
+        "name": "mintGuardian",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
+
+@functools.lru_cache(maxsize=1)
+def load_abi(path: str) -> list:
+    """Читает ABI один раз на процесс; повторный импорт/перезагрузка модуля берёт из кэша."""
+    if not os.path.exists(path):
+        logger.error(f"ABI file not found: {path}")
+        raise FileNotFoundError(f"ABI file missing: {path}")
+    try:
+        with open(path, "rb") as f:
+            # decode отдельно — чтобы битая кодировка по-прежнему уходила в fallback ниже;
+            # ошибки JSON от orjson — подкласс json.JSONDecodeError
+            abi = orjson.loads(f.read().decode("utf-8"))
+        logger.info(f"✅ ABI loaded successfully from {path}")
+        return abi
+    except UnicodeDecodeError as e:
+        logger.error(f"ABI file encoding error: {e}")
+        logger.warning("⚠️ Using fallback ABI due to encoding error")
+        return _FALLBACK_ABI
+    except json.JSONDecodeError as e:
+        logger.error(f"ABI JSON decode error: {e}")
+        raise ValueError(f"Invalid ABI format: {e}")
+
 # ---------------------------------------------------------------------------
 # SAFE МУЛЬТИПОДПИСЬ (ленивая инициализация)
 # ---------------------------------------------------------------------------
 ethereum_client = None
 safe = None
+_safe_lock = asyncio.Lock()
+_safe_failed_at = 0.0  # время последней неудачной инициализации
+SAFE_RETRY_DELAY = 5.0
 
 def get_safe():
     global ethereum_client, safe
     if safe is None:
-        # Получаем рабочий RPC URL из списка
-        rpc_urls = os.getenv("OPBNB_HTTP_URL", "")
-        urls = [u.strip() for u in rpc_urls.split(",") if u.strip()]
-        working_url = None
-        for url in urls:
-            try:
-                provider = Web3.HTTPProvider(url, request_kwargs={'timeout': 3})
-                w3 = Web3(provider)
-                if w3.is_connected():
-                    working_url = url
-                    break
-            except Exception:
-                continue
+        # Узел уже выбран в get_w3() — не опрашиваем все RPC заново
+        working_url = getattr(get_w3().provider, "endpoint_uri", None)
         if not working_url:
             raise Exception("Не удалось подключиться ни к одному RPC-узлу")
         ethereum_client = EthereumClient(working_url)
@@ -66,12 +181,25 @@ def get_safe():
         safe = Safe(safe_address, ethereum_client)
     return safe
 
-async def propose_safe_transaction(to_address: str, data: bytes, value: int = 0) -> str:
-    """
-    Создаёт и отправляет предложение транзакции в Safe.
-    Возвращает tx_hash предложения.
-    """
-    safe = get_safe()
+async def get_safe_async():
+    """Как get_safe, но без гонки при параллельных вызовах и без блокировки event loop."""
+    global _safe_failed_at
+    if safe is not None:
+        return safe
+    async with _safe_lock:
+        if safe is not None:
+            return safe
+        # Все узлы недавно лежали — не дёргаем их снова каждые миллисекунды
+        if time.monotonic() - _safe_failed_at < SAFE_RETRY_DELAY:
+            raise Exception("Safe недоступен, повторная попытка позже")
+        try:
+            return await asyncio.to_thread(get_safe)
+        except Exception:
+            _safe_failed_at = time.monotonic()
+            raise
+
+def _sync_propose_safe_transaction(safe, to_address: str, data: bytes, value: int) -> str:
+    """Сборка, подпись и отправка SafeTx — блокирующие вызовы, выполняются в потоке"""
     safe_tx = SafeTx(
         safe.ethereum_client,
         safe.address,
@@ -97,162 +225,360 @@ async def propose_safe_transaction(to_address: str, data: bytes, value: int = 0)
 
     return safe_tx.safe_tx_hash.hex()
 
+async def propose_safe_transaction(to_address: str, data: bytes, value: int = 0) -> str:
+    """
+    Создаёт и отправляет предложение транзакции в Safe.
+    Возвращает tx_hash предложения.
+    """
+    safe = await get_safe_async()
+    # nonce Safe читается с узла (safe_nonce=None), post_transaction — синхронный HTTP:
+    # всё вместе с подписью уходит из event loop
+    return await asyncio.to_thread(_sync_propose_safe_transaction, safe, to_address, data, value)
+
 # ---------------------------------------------------------------------------
-# ИНИЦИАЛИЗАЦИЯ WEB3 И КОНТРАКТА (как и раньше)
+# ИНИЦИАЛИЗАЦИЯ WEB3 И КОНТРАКТА (лениво — импорт модуля не ходит в сеть)
 # ---------------------------------------------------------------------------
-w3 = get_smart_w3(os.getenv("OPBNB_HTTP_URL"))
-
 NFA_ADDRESS = os.getenv("NFA_CONTRACT_ADDRESS")
 OWNER_ADDRESS = os.getenv("OWNER_ADDRESS")
 PRIVATE_KEY = os.getenv("OWNER_PRIVATE_KEY")
 
+# Блок opBNB ~1 с — опрашивать receipt чаще (дефолт web3 0.1 с) бессмысленно;
+# для локальных сетей можно опустить до 0.25 через env
+TX_POLL_LATENCY = max(0.25, float(os.getenv("TX_POLL_LATENCY", "1.0")))
+TX_RECEIPT_TIMEOUT = 180
+
 if not all([NFA_ADDRESS, OWNER_ADDRESS, PRIVATE_KEY]):
     logger.error("Missing required env vars: NFA_CONTRACT_ADDRESS, OWNER_ADDRESS, OWNER_PRIVATE_KEY")
     raise EnvironmentError("NFA environment variables not set")
 
+# Checksum-форма один раз — web3 не пересчитывает keccak адреса на каждой транзакции
+NFA_ADDRESS = Web3.to_checksum_address(NFA_ADDRESS)
+OWNER_ADDRESS = Web3.to_checksum_address(OWNER_ADDRESS)
+
 abi_path = "contracts/VibeGuardGuardian.abi"
-if not os.path.exists(abi_path):
-    logger.error(f"ABI file not found: {abi_path}")
-    raise FileNotFoundError(f"ABI file missing: {abi_path}")
-
-try:
-    with open(abi_path, "r", encoding="utf-8") as f:
-        ABI = json.load(f)
-    logger.info(f"✅ ABI loaded successfully from {abi_path}")
-except UnicodeDecodeError as e:
-    logger.error(f"ABI file encoding error: {e}")
-    # fallback minimal ABI
-    ABI = [
-        {
-            "anonymous": False,
-            "inputs": [
-                {"indexed": True, "internalType": "address", "name": "owner", "type": "address"},
-                {"indexed": True, "internalType": "uint256", "name": "tokenId", "type": "uint256"},
-                {"indexed": False, "internalType": "string", "name": "name", "type": "string"}
-            ],
-            "name": "GuardianMinted",
-            "type": "event"
-        },
-        {
-            "inputs": [
-                {"internalType": "string", "name": "name", "type": "string"},
-                {"internalType": "string", "name": "imageURI", "type": "string"}
-            ],
-            "name": "mintGuardian",
-            "outputs": [],
-            "stateMutability": "nonpayable",
-            "type": "function"
-        }
-    ]
-    logger.warning("⚠️ Using fallback ABI due to encoding error")
-except json.JSONDecodeError as e:
-    logger.error(f"ABI JSON decode error: {e}")
-    raise ValueError(f"Invalid ABI format: {e}")
+ABI = load_abi(abi_path)
+
+CONTRACT_ADDR = NFA_ADDRESS
+
+@functools.lru_cache(maxsize=1)
+def get_w3() -> Web3:
+    """Подключение к opBNB при первом реальном использовании, а не при импорте"""
+    return get_smart_w3(os.getenv("OPBNB_HTTP_URL"))
+
+@functools.lru_cache(maxsize=1)
+def get_contract():
+    return get_w3().eth.contract(address=CONTRACT_ADDR, abi=ABI)
+
+@functools.lru_cache(maxsize=1)
+def get_chain_id() -> int:
+    """chainId статичен — не даём узлу отвечать на eth_chainId на каждый tx"""
+    return get_w3().eth.chain_id
+
+def _reset_after_fork() -> None:
+    """В дочернем процессе сокеты и nonce-счётчик родителя не годятся — переподключимся при первом вызове"""
+    global ethereum_client, safe, _aw3, _next_nonce, _head_task
+    get_w3.cache_clear()
+    get_contract.cache_clear()
+    get_chain_id.cache_clear()
+    ethereum_client = safe = _aw3 = _next_nonce = _head_task = None
+    _receipt_waiters.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Селекторы и типы аргументов — calldata собираем напрямую через eth_abi,
+# без обхода ABI и ContractFunction на каждый вызов
+_MINT_SELECTOR = function_signature_to_4byte_selector("mintGuardian(string,string)")
+_MINT_TYPES = ("string", "string")
+_UPDATE_SELECTOR = function_signature_to_4byte_selector("updateLearning(uint256,bytes32,uint256)")
+_UPDATE_TYPES = ("uint256", "bytes32", "uint256")
+_ATTEST_SELECTOR = function_signature_to_4byte_selector("attestProtection(uint256,address,uint8)")
+_ATTEST_TYPES = ("uint256", "address", "uint8")
+
+def _calldata(selector: bytes, types: tuple, args: list) -> bytes:
+    return selector + abi_encode(types, args)
 
-contract = w3.eth.contract(address=Web3.to_checksum_address(NFA_ADDRESS), abi=ABI)
+# Топики всех событий ABI — keccak считаем один раз при импорте
+EVENT_TOPICS: dict[str, bytes] = {
+    item["name"]: event_abi_to_log_topic(item)
+    for item in ABI
+    if item.get("type") == "event" and not item.get("anonymous")
+}
+GUARDIAN_MINTED_TOPIC = EVENT_TOPICS.get("GuardianMinted") or Web3.keccak(text="GuardianMinted(address,uint256,string)")
+
+def _event_layout(name: str) -> Optional[tuple[list[str], list[str], list[str]]]:
+    """(имена indexed-аргументов, имена и типы аргументов из data) события по ABI"""
+    event = next((i for i in ABI if i.get("type") == "event" and i.get("name") == name), None)
+    if event is None:
+        return None
+    indexed = [inp["name"] for inp in event["inputs"] if inp.get("indexed")]
+    plain = [inp for inp in event["inputs"] if not inp.get("indexed")]
+    return indexed, [inp["name"] for inp in plain], [inp["type"] for inp in plain]
+
+# Раскладка GuardianMinted разбирается один раз: позиция tokenId в topics и типы data
+_GM_INDEXED, _GM_DATA_NAMES, _GM_DATA_TYPES = (
+    _event_layout("GuardianMinted") or (["owner", "tokenId"], ["name"], ["string"])
+)
+_GM_TOKEN_TOPIC = 1 + _GM_INDEXED.index("tokenId")
+
+def _decode_guardian_minted(log) -> tuple[int, dict]:
+    """tokenId из topics и неиндексированные аргументы из data для лога GuardianMinted"""
+    token_id = int.from_bytes(log['topics'][_GM_TOKEN_TOPIC], "big")
+    values = abi_decode(_GM_DATA_TYPES, bytes(log['data'])) if _GM_DATA_TYPES else ()
+    return token_id, dict(zip(_GM_DATA_NAMES, values))
+
+# Отдельный пул под блокирующую подпись и отправку минта,
+# чтобы минты не занимали дефолтный executor event loop'а
+_mint_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mint")
+
+def shutdown_mint_executor() -> None:
+    """Не ждём зависшие минты при остановке — receipt всё равно придёт в сеть."""
+    _mint_executor.shutdown(wait=False)
+
+# eth-account переименовал rawTransaction -> raw_transaction (в переходных версиях
+# это свойство, а не поле кортежа) — выбираем атрибут один раз по классу, без пробной подписи
+_RAW_TX_FIELD = "raw_transaction" if hasattr(SignedTransaction, "raw_transaction") else "rawTransaction"
+
+def sign_raw_transaction(tx: dict, private_key) -> bytes:
+    """Подписывает транзакцию локально (с coincurve — через C secp256k1) и возвращает raw-байты."""
+    return getattr(Account.sign_transaction(tx, private_key), _RAW_TX_FIELD)
+
+def fetch_tx_params(web3: Web3, address: str, block_identifier: str = "latest") -> tuple[int, int]:
+    """
+    nonce и gasPrice одним JSON-RPC батчем (только через BatchHTTPProvider).
+    Если узел батчи не умеет — двумя запросами.
+    """
+    if isinstance(web3.provider, BatchHTTPProvider):
+        try:
+            nonce, gas_price = web3.provider.make_batch_request([
+                ("eth_getTransactionCount", [address, block_identifier]),
+                ("eth_gasPrice", []),
+            ])
+            return int(nonce, 16), int(gas_price, 16)
+        except Exception as e:
+            logger.debug("Батч nonce/gasPrice не прошёл (%s), запрашиваем по отдельности", e)
+    return web3.eth.get_transaction_count(address, block_identifier), web3.eth.gas_price
+
+# Локальный счётчик nonce владельца: после первого запроса минты не ходят
+# за get_transaction_count и могут идти несколькими транзакциями в блок
+_nonce_lock = threading.Lock()
+_next_nonce: Optional[int] = None
+
+# gasPrice на opBNB почти не меняется секунда к секунде — держим несколько секунд
+_GAS_TTL = 3.0
+_gas_price_cache: dict = {"value": None, "ts": 0.0}
+
+def _store_gas_price(value: int) -> int:
+    _gas_price_cache["value"] = value
+    _gas_price_cache["ts"] = time.monotonic()
+    return value
+
+def _cached_gas_price() -> int:
+    value = _gas_price_cache["value"]
+    if value is not None and time.monotonic() - _gas_price_cache["ts"] < _GAS_TTL:
+        return value
+    return _store_gas_price(get_w3().eth.gas_price)
+
+def _reserve_nonce() -> int:
+    """Следующий nonce владельца; сеть спрашиваем, только если счётчик холодный."""
+    global _next_nonce
+    with _nonce_lock:
+        if _next_nonce is None:
+            # Цена газа приходит тем же батчем — заодно обновляем кэш
+            _next_nonce, gas_price = fetch_tx_params(get_w3(), OWNER_ADDRESS, 'pending')
+            _store_gas_price(gas_price)
+        nonce = _next_nonce
+        _next_nonce += 1
+        return nonce
+
+def _reset_nonce() -> None:
+    global _next_nonce
+    with _nonce_lock:
+        _next_nonce = None
 
 # ---------- СИНХРОННАЯ ФУНКЦИЯ МИНТА (без мультиподписи) ----------
-def _sync_mint_guardian(name: str, image_uri: str):
-    """Синхронная функция минта Guardian NFT (выполняется в executor)"""
-    logger.info(f"⚙️ _sync_mint_guardian вызван с name={name}")
+
+def _send_contract_tx(data: bytes, gas_limit: int):
+    """Подписывает ключом владельца и отправляет вызов контракта (в _mint_executor), возвращает tx_hash"""
+    nonce = _reserve_nonce()
     try:
-        nonce = w3.eth.get_transaction_count(OWNER_ADDRESS)
-        gas_price = w3.eth.gas_price
-        tx = contract.functions.mintGuardian(name, image_uri).build_transaction({
-            'from': OWNER_ADDRESS,
+        tx = {
+            'to': CONTRACT_ADDR,
+            'value': 0,
+            'data': data,
             'nonce': nonce,
-            'gas': 250000,
-            'gasPrice': gas_price
-        })
-        signed_tx = w3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-        raw_tx = (
-            getattr(signed_tx, 'raw_transaction', None) or 
-            getattr(signed_tx, 'rawTransaction', None) or 
-            getattr(signed_tx, 'transaction', None)
-        )
-        if raw_tx is None:
-            raise AttributeError("Cannot find raw transaction attribute in signed object")
-        tx_hash = w3.eth.send_raw_transaction(raw_tx)
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
-
-        for i, log in enumerate(receipt.logs):
-            topics_hex = [t.hex() for t in log['topics']] if log['topics'] else []
-            logger.info(f"📄 Log {i}: address={log['address']}, topics={topics_hex}")
-
-        guardian_minted_topic = Web3.keccak(text="GuardianMinted(address,uint256,string)").hex()
-        logger.info(f"🔍 Ожидаемый topic: {guardian_minted_topic}")
-
-        token_id = None
-        for log in receipt.logs:
-            if log['topics'] and log['topics'][0].hex() == guardian_minted_topic:
-                if len(log['topics']) >= 3:
-                    token_id = int(log['topics'][2].hex(), 16)
-                elif len(log['topics']) >= 2:
-                    token_id = int(log['topics'][1].hex(), 16)
-                else:
-                    token_id = None
-                break
-
-        if token_id is None:
-            if receipt.logs:
-                if len(receipt.logs[0]['topics']) >= 3:
-                    token_id = int(receipt.logs[0]['topics'][2].hex(), 16)
-                    logger.warning(f"GuardianMinted event not found, using fallback token_id={token_id}")
-                else:
-                    token_id = 0
-                    logger.error("No suitable topics in logs, token_id set to 0")
+            'gas': gas_limit,
+            'gasPrice': _cached_gas_price(),
+            'chainId': get_chain_id(),
+        }
+        return get_w3().eth.send_raw_transaction(sign_raw_transaction(tx, PRIVATE_KEY))
+    except Exception:
+        # Транзакция не ушла — локальный счётчик мог разойтись с сетью
+        _reset_nonce()
+        raise
+
+def _sync_send_mint(name: str, image_uri: str):
+    logger.debug("⚙️ _sync_send_mint name=%s", name)
+    return _send_contract_tx(_calldata(_MINT_SELECTOR, _MINT_TYPES, [name, image_uri]), 250000)
+
+def _token_id_from_receipt(receipt) -> int:
+    token_id = None
+    # Сравниваем байты (HexBytes) — без .hex() на каждый лог
+    minted = next(
+        (log for log in receipt.logs
+         if log['address'] == CONTRACT_ADDR and log['topics'] and log['topics'][0] == GUARDIAN_MINTED_TOPIC),
+        None,
+    )
+    if minted is not None:
+        try:
+            token_id, _ = _decode_guardian_minted(minted)
+        except Exception as e:
+            logger.warning("Не удалось разобрать GuardianMinted: %s", e)
+
+    if token_id is None:
+        # Диагностика только когда события нет; форматирование — лениво, внутри logging
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, log in enumerate(receipt.logs):
+                logger.debug("📄 Log %d: addr=%s topic0=%s", i, log['address'],
+                             log['topics'][0].hex() if log['topics'] else '-')
+        if receipt.logs:
+            if len(receipt.logs[0]['topics']) >= 3:
+                token_id = int.from_bytes(receipt.logs[0]['topics'][2], "big")
+                logger.warning("GuardianMinted event not found, using fallback token_id=%s", token_id)
             else:
                 token_id = 0
-                logger.error("No logs in receipt, token_id set to 0")
+                logger.error("No suitable topics in logs, token_id set to 0")
+        else:
+            token_id = 0
+            logger.error("No logs in receipt, token_id set to 0")
+    return token_id
 
-        logger.info(f"✅ Guardian minted! Token ID: {token_id} | Name: {name}")
-        return token_id
+# Ожидание receipt — это минуты опроса; через AsyncWeb3 оно идёт в event loop
+# и не держит поток _mint_executor
+_aw3: Optional[AsyncWeb3] = None
+
+def _get_async_w3() -> Optional[AsyncWeb3]:
+    global _aw3
+    if _aw3 is None:
+        endpoint = getattr(get_w3().provider, "endpoint_uri", None)
+        if not endpoint or not str(endpoint).startswith("http"):
+            return None  # WS-узел — ждём по-старому в executor
+        _aw3 = AsyncWeb3(AsyncHTTPProvider(endpoint, request_kwargs={"timeout": 10}))
+    return _aw3
+
+# Если задан WS-узел — одно подключение с подпиской newHeads на все ожидающие
+# минты: receipt запрашиваем только на новом блоке, а не опросом по таймеру
+OPBNB_WS_URL = os.getenv("OPBNB_WS_URL")
+_receipt_waiters: dict[bytes, asyncio.Future] = {}
+_head_task: Optional[asyncio.Task] = None
+
+async def _watch_heads() -> None:
+    global _head_task
+    try:
+        async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(OPBNB_WS_URL)) as ws_w3:
+            await ws_w3.eth.subscribe("newHeads")
+            async for _ in ws_w3.ws.process_subscriptions():
+                for tx_hash, fut in list(_receipt_waiters.items()):
+                    if fut.done():
+                        continue
+                    try:
+                        receipt = await ws_w3.eth.get_transaction_receipt(tx_hash)
+                    except TransactionNotFound:
+                        continue
+                    fut.set_result(receipt)
+                if not _receipt_waiters:
+                    # Сбрасываем до выхода из async with — новый ожидающий поднимет свою подписку
+                    _head_task = None
+                    break
     except Exception as e:
-        logger.error(f"mint_guardian failed: {e}", exc_info=True)
-        raise
+        logger.warning(f"⚠️ WS-подписка newHeads упала, переходим на опрос: {e}")
+        for fut in _receipt_waiters.values():
+            if not fut.done():
+                fut.set_exception(e)
+    finally:
+        if _head_task is asyncio.current_task():
+            _head_task = None
+
+async def _receipt_via_heads(tx_hash):
+    global _head_task
+    fut = asyncio.get_running_loop().create_future()
+    _receipt_waiters[bytes(tx_hash)] = fut
+    if _head_task is None:
+        _head_task = asyncio.create_task(_watch_heads())
+    try:
+        return await asyncio.wait_for(fut, TX_RECEIPT_TIMEOUT)
+    finally:
+        _receipt_waiters.pop(bytes(tx_hash), None)
+
+async def _wait_for_receipt(tx_hash):
+    if OPBNB_WS_URL:
+        try:
+            return await _receipt_via_heads(tx_hash)
+        except asyncio.TimeoutError:
+            raise
+        except Exception:
+            pass  # WS недоступен — ниже обычный опрос по HTTP
+    aw3 = _get_async_w3()
+    if aw3 is None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _mint_executor,
+            functools.partial(
+                get_w3().eth.wait_for_transaction_receipt,
+                tx_hash, timeout=TX_RECEIPT_TIMEOUT, poll_latency=TX_POLL_LATENCY,
+            ),
+        )
+    return await aw3.eth.wait_for_transaction_receipt(
+        tx_hash, timeout=TX_RECEIPT_TIMEOUT, poll_latency=TX_POLL_LATENCY
+    )
 
 # ---------- АСИНХРОННЫЕ ФУНКЦИИ ДЛЯ МУЛЬТИПОДПИСИ ----------
 async def update_guardian_learning(token_id: int, new_merkle_root: bytes, protected_usd: int):
     """Асинхронно отправляет предложение updateLearning через Safe"""
     try:
-        tx_data = contract.functions.updateLearning(token_id, new_merkle_root, protected_usd).build_transaction({
-            'from': OWNER_ADDRESS,
-            'nonce': 0,
-            'gas': 150000,
-            'gasPrice': 0
-        })
+        # Чистое ABI-кодирование, без RPC (build_transaction ходит за chainId/gas)
+        data = _calldata(_UPDATE_SELECTOR, _UPDATE_TYPES, [token_id, new_merkle_root, protected_usd])
         tx_hash = await propose_safe_transaction(
-            to_address=NFA_ADDRESS,
-            data=tx_data['data'],
+            to_address=CONTRACT_ADDR,
+            data=data,
             value=0
         )
-        logger.info(f"✅ Предложение updateLearning отправлено, tx_hash={tx_hash}")
+        logger.info("✅ Предложение updateLearning отправлено, tx_hash=%s", tx_hash,
+                    extra={"safe_tx_hash": tx_hash, "token_id": token_id})
         return None
     except Exception as e:
-        logger.error(f"update_guardian_learning failed: {e}", exc_info=True)
+        logger.error("update_guardian_learning failed: %s", e, exc_info=True)
         raise
 
 async def attest_protection(token_id: int, wallet: str, risk_score: int):
     """Асинхронно отправляет предложение attestProtection через Safe"""
     try:
-        tx_data = contract.functions.attestProtection(token_id, wallet, risk_score).build_transaction({
-            'from': OWNER_ADDRESS,
-            'nonce': 0,
-            'gas': 100000,
-            'gasPrice': 0
-        })
+        data = _calldata(_ATTEST_SELECTOR, _ATTEST_TYPES, [token_id, wallet, risk_score])
         tx_hash = await propose_safe_transaction(
-            to_address=NFA_ADDRESS,
-            data=tx_data['data'],
+            to_address=CONTRACT_ADDR,
+            data=data,
             value=0
         )
-        logger.info(f"✅ Предложение attestProtection отправлено, tx_hash={tx_hash}")
+        logger.info("✅ Предложение attestProtection отправлено, tx_hash=%s", tx_hash,
+                    extra={"safe_tx_hash": tx_hash, "token_id": token_id})
         return None
     except Exception as e:
-        logger.error(f"attest_protection failed: {e}", exc_info=True)
+        logger.error("attest_protection failed: %s", e, exc_info=True)
         raise
 
-# ---------- АСИНХРОННАЯ ОБЁРТКА ДЛЯ МИНТА (остаётся через executor) ----------
+# ---------- МИНТ: подпись в _mint_executor, ожидание receipt — асинхронно ----------
 async def mint_guardian(name: str, image_uri: str):
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, _sync_mint_guardian, name, image_uri)
+    try:
+        loop = asyncio.get_running_loop()
+        tx_hash = await loop.run_in_executor(_mint_executor, _sync_send_mint, name, image_uri)
+        receipt = await _wait_for_receipt(tx_hash)
+        token_id = _token_id_from_receipt(receipt)
+        # Одна запись на минт; поля в extra — для структурированных обработчиков
+        logger.info(
+            "✅ Guardian minted! Token ID: %s | Name: %s | tx=%s", token_id, name, tx_hash,
+            extra={"tx_hash": tx_hash, "token_id": token_id, "guardian_name": name},
+        )
+        return token_id
+    except Exception as e:
+        logger.error("mint_guardian failed: %s", e, exc_info=True)
+        raise
@@ -94,9 +94,10 @@ async def test_contract():
     
     # Оценка газа для функции logScan
     try:
-        test_target = "0x742d35Cc6634C0532925a3b8D4E7E0E0e9e0dF5D"  # Тестовый адрес
+        # Тестовый адрес — checksum один раз, используется и в оценке, и в отправке
+        test_target = Web3.to_checksum_address("0x742d35Cc6634C0532925a3b8D4E7E0E0e9e0dF5D")
         gas_estimate = contract.functions.logScan(
-            Web3.to_checksum_address(test_target),
+            test_target,
             85,  # score
             True,  # isSafe
             account.address,
@@ -120,7 +121,7 @@ async def test_contract():
         nonce = w3.eth.get_transaction_count(account.address, 'pending')
         
         tx = contract.functions.logScan(
-            Web3.to_checksum_address(test_target),
+            test_target,
             85,  # score
             True,  # isSafe
             account.address,
@@ -137,7 +138,9 @@ async def test_contract():
         print(f"✅ Транзакция отправлена: {tx_hash.hex()}")
         
         # Ожидание подтверждения
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        receipt = w3.eth.wait_for_transaction_receipt(
+            tx_hash, timeout=120, poll_latency=float(os.getenv("TX_POLL_LATENCY", "1.0"))
+        )
         
         if receipt.status == 1:
             print(f"✅ Транзакция подтверждена в блоке {receipt.blockNumber}")
@@ -0,0 +1,37 @@
+"""
+Общие фикстуры тестов VibeGuard AI.
+
+Параллельный прогон: pytest -n auto --dist=loadfile
+loadfile держит тесты одного файла на одном воркере — session-фикстуры
+(event loop, bot_module) создаются там один раз. Каждый воркер — отдельный
+процесс со своим модулем bot, поэтому правка bot.OWNERS в фикстуре owners
+и monkeypatch других тестов между воркерами не пересекаются.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """Один event loop на всю сессию вместо нового цикла на каждый async-тест"""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def bot_module():
+    """bot импортируется один раз; тесты патчат его через monkeypatch.setattr(bot_module, ...)"""
+    import bot
+    return bot
+
+
+@pytest.fixture(scope="session")
+def bot_smart_module():
+    """bot_smart требует DATABASE_URL уже при импорте; тесты к базе не подключаются"""
+    os.environ.setdefault("DATABASE_URL", "postgresql://localhost/vibeguard_test")
+    import bot_smart
+    return bot_smart
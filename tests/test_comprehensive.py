@@ -3,54 +3,83 @@
 Покрывают реальную логику работы системы.
 """
 
-import pytest
 import asyncio
+import pytest
 import os
+import orjson
 from unittest.mock import AsyncMock, MagicMock, patch
-from web3 import Web3
-import sys
-
-# Добавляем src в путь для импорта
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+from types import MappingProxyType
 
 # Импортируем тестируемые модули
 from bot import (
     verify_wallet, check_scam, process_bnb_tx, process_erc20_log,
-    require_multisig, confirm_action, is_owner, _pending_actions,
-    bnb_to_usd, token_to_usd, get_decimals, rpc
+    is_owner, bnb_to_usd, token_to_usd, get_decimals, rpc
 )
-from agent_bot import analyze_event_ai
+
+# Код в этих тестах не смотрит на ts — достаточно константы
+_FIXED_TS = 0.0
+
+# Общие адреса и суммы — строки собираются один раз на модуль
+ADDR_CS = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
+ADDR = ADDR_CS.lower()
+BNB_TX_VALUE_HEX = "0xDE0B6B3A7640000"         # 1 BNB в wei; цену в USD тесты подменяют
+TOKEN_AMOUNT_HEX = "0x152D02C7E14AF6800000"    # 100 000 токенов при 18 decimals
+
+
+@pytest.fixture(autouse=True)
+def owners(bot_module):
+    """Владельцы меняются на месте в bot.OWNERS — без patch() и нового множества на каждый тест"""
+    saved = set(bot_module.OWNERS)
+    bot_module.OWNERS.clear()
+    bot_module.OWNERS.update({12345, 67890})
+    yield bot_module.OWNERS
+    bot_module.OWNERS.clear()
+    bot_module.OWNERS.update(saved)
 
 
 class TestWalletVerification:
     """Тесты верификации кошельков"""
     
     @pytest.mark.asyncio
-    async def test_valid_wallet_verification(self):
+    async def test_valid_wallet_verification(self, bot_module, monkeypatch):
         """Тест успешной верификации валидного кошелька"""
         user_id = 12345
-        address = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
+        address = ADDR_CS
         signature = "0x" + "a" * 130  # Мок подписи
         
-        with patch('bot.db') as mock_db, \
-             patch('bot.save_db') as mock_save, \
-             patch('bot.Web3.is_address', return_value=True), \
-             patch('bot.encode_defunct'), \
-             patch('bot.Web3().eth.account.recover_message', return_value=address):
-            
-            mock_db.__getitem__ = MagicMock(return_value={
-                "pending_verifications": {
-                    str(user_id): {"nonce": "test_nonce", "ts": asyncio.get_event_loop().time()}
-                }
-            })
-            mock_db.__setitem__ = MagicMock()
-            mock_db.get = MagicMock(return_value=[])
-            
-            result, message = await verify_wallet(user_id, address, signature)
-            
-            assert result is True
-            assert "✅ Кошелёк подключён" in message
-            mock_save.assert_called_once()
+        state = {
+            "pending_verifications": {
+                str(user_id): {"nonce": "test_nonce", "ts": _FIXED_TS}
+            },
+            "connected_wallets": {},
+        }
+        
+        mock_save = MagicMock()
+        monkeypatch.setattr(bot_module, "db", state)
+        monkeypatch.setattr(bot_module, "mark_user_dirty", mock_save)
+        monkeypatch.setattr(bot_module, "encode_defunct", MagicMock())
+        monkeypatch.setattr(bot_module.Account, "recover_message", MagicMock(return_value=address))
+        
+        result, message = await verify_wallet(user_id, address, signature)
+        
+        assert result is True
+        assert "✅ Кошелёк успешно привязан" in message
+        mock_save.assert_called()
+        assert state["connected_wallets"][str(user_id)][0]["address"] == ADDR
+        assert str(user_id) not in state["pending_verifications"]
+    
+    def test_legacy_wallet_rows_normalized(self, bot_module, monkeypatch):
+        """Старые записи с адресом в checksum-регистре снова находятся по адресу"""
+        mock_dirty = MagicMock()
+        monkeypatch.setattr(bot_module, "db", {
+            "connected_wallets": {"12345": [{"address": ADDR_CS, "label": "Main Wallet"}]},
+        })
+        monkeypatch.setattr(bot_module, "mark_user_dirty", mock_dirty)
+        
+        bot_module._normalize_wallet_rows()
+        
+        assert bot_module._wallet_watchers(ADDR_CS) == [12345]
+        mock_dirty.assert_called_once_with("connected_wallets", "12345")
     
     @pytest.mark.asyncio
     async def test_invalid_wallet_address(self):
@@ -62,221 +91,458 @@ class TestWalletVerification:
         result, message = await verify_wallet(user_id, address, signature)
         
         assert result is False
-        assert "Невалидный формат адреса" in message
+        assert "Невалидный адрес" in message
     
     @pytest.mark.asyncio
-    async def test_invalid_signature_format(self):
+    async def test_invalid_signature_format(self, bot_module, monkeypatch):
         """Тест невалидного формата подписи"""
         user_id = 12345
-        address = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
+        address = ADDR_CS
         signature = "short_signature"
+        monkeypatch.setattr(bot_module, "db", {
+            "pending_verifications": {str(user_id): {"nonce": "test_nonce", "ts": _FIXED_TS}},
+            "connected_wallets": {},
+        })
         
         result, message = await verify_wallet(user_id, address, signature)
         
         assert result is False
-        assert "Невалидный формат подписи" in message
+        assert "Ошибка подписи" in message
+
+
+class TestDbFlush:
+    """Тесты отложенной записи БД"""
+
+    @pytest.mark.asyncio
+    async def test_shutdown_keeps_inflight_rows(self, bot_module, monkeypatch):
+        """Ключи прерванной записи _db_flusher попадают в финальный flush_db при остановке"""
+        key = ("connected_wallets", "12345")
+        started = asyncio.Event()
+        calls: list[set] = []
+
+        async def fake_save_rows(keys):
+            calls.append(set(keys))
+            if len(calls) == 1:
+                started.set()
+                await asyncio.sleep(3600)  # запись _db_flusher застревает до отмены
+            return True
+
+        monkeypatch.setattr(bot_module, "save_user_rows", fake_save_rows)
+        monkeypatch.setattr(bot_module, "save_db", AsyncMock())
+        monkeypatch.setattr(bot_module, "shutdown_mint_executor", MagicMock())
+        monkeypatch.setattr(bot_module, "DB_FLUSH_DELAY", 0)
+        monkeypatch.setattr(bot_module, "_dirty_rows", set())
+        monkeypatch.setattr(bot_module, "_main_tasks", [])
+        monkeypatch.setattr(bot_module, "_shutdown", False)
+        monkeypatch.setattr(bot_module, "_shutdown_event", asyncio.Event())
+        flusher = asyncio.create_task(bot_module._db_flusher())
+        monkeypatch.setattr(bot_module, "_flusher_task", flusher)
+        
+        bot_module.mark_user_dirty(*key)
+        await started.wait()
+        await bot_module.graceful_shutdown("SIGTERM")
+        
+        assert flusher.cancelled()
+        assert calls == [{key}, {key}]
+        assert not bot_module._dirty_rows
+
+
+_HONEYPOT_RESP = {
+    "result": {
+        ADDR: {
+            "is_honeypot": "1",
+            "is_open_source": "0",
+            "is_proxy": "0",
+            "can_take_back_ownership": "0",
+            "hidden_owner": "0"
+        }
+    }
+}
+
+_SAFE_RESP = {
+    "result": {
+        ADDR: {
+            "is_honeypot": "0",
+            "is_open_source": "1",
+            "is_proxy": "0",
+            "can_take_back_ownership": "0",
+            "hidden_owner": "0"
+        }
+    }
+}
+
+class _HTTPResp:
+    """Ответ без MagicMock: status и уже сериализованное тело"""
+
+    def __init__(self, body: bytes):
+        self.status = 200
+        self._body = body
+
+    def raise_for_status(self) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return self._body
+
+    @property
+    def content(self) -> "_HTTPResp":
+        return self
+
+    async def iter_any(self):
+        # Мелкими кусками — потоковый разбор видит разрезанные токены
+        for i in range(0, len(self._body), 16):
+            yield self._body[i:i + 16]
+
+
+class _HTTPCtx:
+    """async with http_session.get(...) as r — отдаёт заранее собранный ответ"""
+
+    def __init__(self, resp: _HTTPResp):
+        self._resp = resp
+
+    async def __aenter__(self) -> _HTTPResp:
+        return self._resp
+
+    async def __aexit__(self, *exc) -> bool:
+        return False
+
+
+class _FakeSession:
+    """Подменяет bot.http_session: на каждый get()/post() — новый контекст над тем же ответом"""
+
+    def __init__(self, payload: dict):
+        self._resp = _HTTPResp(orjson.dumps(payload))
+
+    def get(self, *args, **kwargs) -> _HTTPCtx:
+        return _HTTPCtx(self._resp)
+
+    post = get
 
 
 class TestScamDetection:
     """Тесты определения скам-контрактов"""
     
     @pytest.mark.asyncio
-    async def test_honeypot_detection(self):
-        """Тест определения honeypot"""
-        addr = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
+    @pytest.mark.parametrize("payload, expected", [
+        (_HONEYPOT_RESP, ["🍯 HONEYPOT", "🔐 ЗАКРЫТЫЙ КОД"]),
+        (_SAFE_RESP, []),
+    ], ids=["honeypot", "safe"])
+    async def test_check_scam(self, bot_module, monkeypatch, payload, expected):
+        """Тест определения honeypot и безопасного контракта"""
+        monkeypatch.setattr(bot_module, "http_session", _FakeSession(payload))
+        risks = await check_scam(ADDR_CS)
         
-        mock_response = {
-            "result": {
-                addr.lower(): {
-                    "is_honeypot": "1",
-                    "is_open_source": "0",
-                    "is_proxy": "0",
-                    "can_take_back_ownership": "0",
-                    "hidden_owner": "0"
-                }
-            }
-        }
+        assert all(risk in risks for risk in expected)
+        assert len(risks) == len(expected)
+
+
+_RPC_RANGE_ERROR = {"code": -32005, "message": "query returned more than 10000 results"}
+
+
+def _has_three_topics(log: dict) -> bool:
+    return len(log.get("topics", ())) >= 3
+
+
+class TestRpcFilter:
+    """Тесты потоковой фильтрации ответов RPC"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("fast", [True, False], ids=["ijson", "orjson"])
+    @pytest.mark.parametrize("payload, expected", [
+        ({"jsonrpc": "2.0", "id": 1, "result": [{"topics": ["a", "b", "c"]}, {"topics": ["a"]}]},
+         {"result": [{"topics": ["a", "b", "c"]}]}),
+        ({"jsonrpc": "2.0", "id": 1, "error": _RPC_RANGE_ERROR},
+         {"error": _RPC_RANGE_ERROR}),
+    ], ids=["result", "error"])
+    async def test_rpc_post_keep(self, bot_module, monkeypatch, fast, payload, expected):
+        """Ошибка узла не превращается в пустой result"""
+        monkeypatch.setattr(bot_module, "_IJSON_FAST", fast)
+        monkeypatch.setattr(bot_module, "_rpc_latency", {})
+        monkeypatch.setattr(bot_module, "http_session", _FakeSession(payload))
         
-        with patch('bot.Web3.is_address', return_value=True), \
-             patch('bot.http_session.get') as mock_get:
-            
-            mock_get.return_value.__aenter__.return_value.status = 200
-            mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response)
-            
-            risks = await check_scam(addr)
-            
-            assert "🍯 HONEYPOT" in risks
-            assert "🔐 ЗАКРЫТЫЙ КОД" in risks
-    
+        result = await bot_module._rpc_post("http://rpc.test", b"{}", None, _has_three_topics)
+        
+        assert result.get("result") == expected.get("result")
+        assert result.get("error") == expected.get("error")
+
+
+class TestRpcHedging:
+    """Тесты хеджирования запросов по узлам RPC"""
+
+    @pytest.fixture
+    def attempts(self, bot_module, monkeypatch):
+        """Узлы a/b/c: ответ через delays[url] сек, None — узел падает"""
+        calls: list[str] = []
+        delays: dict[str, float] = {}
+
+        async def fake_attempt(url, body, timeout, keep):
+            calls.append(url)
+            delay = delays[url]
+            if delay is None:
+                raise RuntimeError(f"{url} down")
+            await asyncio.sleep(delay)
+            return {"result": url}
+
+        monkeypatch.setattr(bot_module, "ALL_RPC_URLS", ["a", "b", "c"])
+        monkeypatch.setattr(bot_module, "_rpc_latency", {"a": 0.01, "b": 0.02, "c": 0.03})
+        monkeypatch.setattr(bot_module, "_rpc_backoff", {})
+        monkeypatch.setattr(bot_module, "RPC_HEDGE_DELAY_MIN", 0.05)
+        monkeypatch.setattr(bot_module, "_rpc_attempt", fake_attempt)
+        return calls, delays
+
     @pytest.mark.asyncio
-    async def test_safe_contract(self):
-        """Тест безопасного контракта"""
-        addr = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
+    @pytest.mark.parametrize("delays, expected, expected_calls", [
+        ({"a": 0.0, "b": 0.0, "c": 0.0}, "a", ["a"]),          # быстрый узел — без хеджа
+        ({"a": 1.0, "b": 0.0, "c": 0.0}, "b", ["a", "b"]),     # медленный — хедж на b
+        ({"a": None, "b": None, "c": 0.0}, "c", ["a", "b", "c"]),  # упавшие — сразу дальше
+    ], ids=["fast", "hedged", "failover"])
+    async def test_rpc_hedge(self, bot_module, attempts, delays, expected, expected_calls):
+        """Второй запрос уходит только по таймауту хеджа или после падения узла"""
+        calls, node_delays = attempts
+        node_delays.update(delays)
         
-        mock_response = {
-            "result": {
-                addr.lower(): {
-                    "is_honeypot": "0",
-                    "is_open_source": "1",
-                    "is_proxy": "0",
-                    "can_take_back_ownership": "0",
-                    "hidden_owner": "0"
-                }
-            }
-        }
+        result = await bot_module.rpc({"method": "eth_blockNumber"})
         
-        with patch('bot.Web3.is_address', return_value=True), \
-             patch('bot.http_session.get') as mock_get:
-            
-            mock_get.return_value.__aenter__.return_value.status = 200
-            mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response)
-            
-            risks = await check_scam(addr)
-            
-            assert len(risks) == 0
+        assert result == {"result": expected}
+        assert calls == expected_calls
+
+
+class _RequestsResp:
+    """Ответ requests.Session.post: только то, что читает BatchHTTPProvider"""
+
+    def __init__(self, body: bytes):
+        self.content = body
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class _RecordingRequestsSession:
+    """Синхронная сессия для HTTPProvider: запоминает тела POST и отвечает заранее заданным телом"""
+
+    def __init__(self, reply):
+        self.bodies: list = []
+        self._body = orjson.dumps(reply)
+
+    def post(self, url, data=None, **kwargs) -> _RequestsResp:
+        self.bodies.append(orjson.loads(data))
+        return _RequestsResp(self._body)
+
+
+class TestTxParamsBatch:
+    """Тесты батча nonce/gasPrice перед подписью транзакции"""
+
+    def test_fetch_tx_params_single_batch(self, bot_module):
+        """Оба вызова уходят одним POST; ответы узла сопоставляются по id"""
+        import nfa
+        from web3 import Web3
+        # Узел вправе вернуть элементы батча в любом порядке
+        session = _RecordingRequestsSession([
+            {"jsonrpc": "2.0", "id": 1, "result": hex(10**9)},
+            {"jsonrpc": "2.0", "id": 0, "result": "0x5"},
+        ])
+        provider = nfa.BatchHTTPProvider("http://rpc.test", request_kwargs={"timeout": 1}, session=session)
+        
+        assert nfa.fetch_tx_params(Web3(provider), ADDR_CS, "pending") == (5, 10**9)
+        assert len(session.bodies) == 1
+        assert [(c["method"], c["params"]) for c in session.bodies[0]] == [
+            ("eth_getTransactionCount", [ADDR_CS, "pending"]),
+            ("eth_gasPrice", []),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_chain_w3_batches(self, bot_module, monkeypatch):
+        """Web3 для log_onchain собран на BatchHTTPProvider — fetch_tx_params идёт батчем"""
+        import nfa
+        monkeypatch.setattr(nfa.Web3, "is_connected", lambda self, *a, **kw: True)
+        monkeypatch.setattr(bot_module, "_RAW_HTTP_URL", "http://rpc.test")
+        monkeypatch.setattr(bot_module, "_chain_w3", None)
+        
+        w3 = await bot_module.get_chain_w3()
+        
+        assert isinstance(w3.provider, nfa.BatchHTTPProvider)
+
+
+@pytest.fixture(scope="session")
+def whale_bnb_tx():
+    """Транзакция BNB собирается раз на сессию; MappingProxyType не даст тестам её испортить"""
+    return MappingProxyType({
+        "value": BNB_TX_VALUE_HEX,
+        "from": ADDR_CS,
+        "to": "0x8ba1f109551bD432803012645Hac136c"
+    })
+
+
+@pytest.fixture(scope="session")
+def whale_erc20_log():
+    """Transfer-лог ERC20 в режиме только для чтения"""
+    return MappingProxyType({
+        "address": ADDR_CS,
+        "topics": (
+            "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
+            "0x000000000000000000000000742d35cc6634c0532925a3b8d4c9db96c4b4db45",
+            "0x0000000000000000000000008ba1f109551bd432803012645hac136c"
+        ),
+        "data": TOKEN_AMOUNT_HEX
+    })
 
 
 class TestTransactionProcessing:
     """Тесты обработки транзакций"""
-    
+
+    @pytest.fixture(scope="class", autouse=True)
+    def bot_io(self, bot_module):
+        """Внешний I/O бота патчим один раз на класс, а не стеком patch() в каждом тесте"""
+        mocks = {
+            "call_ai": AsyncMock(return_value="Крупная транзакция"),
+            "check_scam": AsyncMock(return_value=[]),
+            "notify_owners": AsyncMock(),
+            "broadcast_whale": AsyncMock(),
+            "log_onchain": AsyncMock(),
+            "_wallet_watchers": MagicMock(return_value=[]),
+        }
+        with pytest.MonkeyPatch.context() as mp:
+            for name, mock in mocks.items():
+                mp.setattr(bot_module, name, mock)
+            yield mocks
+
+    @pytest.fixture(autouse=True)
+    def _reset_bot_io(self, bot_io):
+        for mock in bot_io.values():
+            mock.reset_mock()
+
     @pytest.mark.asyncio
-    async def test_whale_detection_bnb(self):
+    async def test_whale_detection_bnb(self, bot_module, monkeypatch, bot_io, whale_bnb_tx):
         """Тест определения кита (крупной транзакции BNB)"""
-        tx = {
-            "value": "0xDE0B6B3A7640000",  # 1000 BNB в hex
-            "from": "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45",
-            "to": "0x8ba1f109551bD432803012645Hac136c"
+        # Отправитель в watch-листе — владельцы получают WATCHLIST-алерт
+        mock_db = {
+            "cfg": {"limit_usd": 10000, "ignore": [], "watch": [ADDR]},
+            "stats": {"whales": 0}
         }
+        monkeypatch.setattr(bot_module, "db", mock_db)
+        monkeypatch.setattr(bot_module, "bnb_to_usd", AsyncMock(return_value=500000))  # $500K
         
-        with patch('bot.db_lock') as mock_lock, \
-             patch('bot.bnb_to_usd', return_value=500000),  # $500K
-             patch('bot._wallet_watchers', return_value=[]), \
-             patch('bot.call_ai', return_value="Крупная транзакция"), \
-             patch('bot.check_scam', return_value=[]), \
-             patch('bot.notify_owners') as mock_notify, \
-             patch('bot.log_onchain') as mock_log:
-            
-            mock_lock.__aenter__ = AsyncMock()
-            mock_db = {
-                "cfg": {"limit_usd": 10000, "ignore": [], "watch": []},
-                "stats": {"whales": 0}
-            }
-            mock_lock.__aenter__.return_value = mock_db
-            
-            await process_bnb_tx(tx)
-            
-            # Проверяем, что статистика обновилась
-            assert mock_db["stats"]["whales"] == 1
-            # Проверяем, что владельцы уведомлены
-            mock_notify.assert_called()
-            # Проверяем, что транзакция залогирована в блокчейн
-            mock_log.assert_called()
+        await process_bnb_tx(whale_bnb_tx)
+        
+        # Проверяем, что статистика обновилась
+        assert mock_db["stats"]["whales"] == 1
+        # Проверяем, что владельцы уведомлены, а алерт ушёл в рассылку
+        bot_io["notify_owners"].assert_called()
+        bot_io["broadcast_whale"].assert_called()
+        # Проверяем, что транзакция залогирована в блокчейн
+        bot_io["log_onchain"].assert_called()
     
     @pytest.mark.asyncio
-    async def test_erc20_whale_detection(self):
+    async def test_erc20_whale_detection(self, bot_module, monkeypatch, bot_io, whale_erc20_log):
         """Тест определения кита (ERC20 токен)"""
-        log = {
-            "address": "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45",
-            "topics": [
-                "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
-                "0x000000000000000000000000742d35cc6634c0532925a3b8d4c9db96c4b4db45",
-                "0x0000000000000000000000008ba1f109551bd432803012645hac136c"
-            ],
-            "data": "0x152D02C7E14AF6800000"  # 1000000 токенов
+        # Отправитель в watch-листе — владельцы получают WATCHLIST-алерт
+        mock_db = {
+            "cfg": {"limit_usd": 10000, "ignore": [], "watch": [ADDR]},
+            "stats": {"whales": 0}
         }
+        monkeypatch.setattr(bot_module, "db", mock_db)
+        monkeypatch.setattr(bot_module, "get_decimals", AsyncMock(return_value=18))
+        monkeypatch.setattr(bot_module, "token_to_usd", AsyncMock(return_value=75000))  # $75K
         
-        with patch('bot.db_lock') as mock_lock, \
-             patch('bot.get_decimals', return_value=18), \
-             patch('bot.token_to_usd', return_value=75000),  # $75K
-             patch('bot._wallet_watchers', return_value=[]), \
-             patch('bot.call_ai', return_value="Крупный перевод токенов"), \
-             patch('bot.check_scam', return_value=[]), \
-             patch('bot.notify_owners') as mock_notify:
-            
-            mock_lock.__aenter__ = AsyncMock()
-            mock_db = {
-                "cfg": {"limit_usd": 10000, "ignore": [], "watch": []},
-                "stats": {"whales": 0}
-            }
-            mock_lock.__aenter__.return_value = mock_db
-            
-            await process_erc20_log(log)
-            
-            assert mock_db["stats"]["whales"] == 1
-            mock_notify.assert_called()
+        await process_erc20_log(whale_erc20_log)
+        
+        assert mock_db["stats"]["whales"] == 1
+        bot_io["notify_owners"].assert_called()
+        bot_io["broadcast_whale"].assert_called()
 
 
 class TestMultisig:
     """Тесты мультиподписей"""
+
+    @pytest.fixture(autouse=True)
+    def smart_owners(self, bot_smart_module, monkeypatch):
+        """Мультиподписи живут в bot_smart — у него свой OWNERS"""
+        monkeypatch.setattr(bot_smart_module, "OWNERS", {12345, 67890})
+        return bot_smart_module.OWNERS
+
+    @pytest.fixture(autouse=True)
+    def pending(self, bot_smart_module, monkeypatch):
+        """Свой _pending_actions на каждый тест — общий словарь модуля не трогаем"""
+        monkeypatch.setattr(bot_smart_module, "_pending_actions", {})
+        return bot_smart_module._pending_actions
     
     @pytest.mark.asyncio
-    async def test_single_owner_action(self):
+    async def test_single_owner_action(self, bot_smart_module, smart_owners):
         """Тест действия с одним владельцем"""
-        with patch('bot.OWNERS', {12345}):
-            result, message = await require_multisig("test_action", "target", 12345)
-            
-            assert result is True
-            assert "Одиночный владелец" in message
+        smart_owners.discard(67890)
+        result, message = await bot_smart_module.require_multisig("test_action", "target", 12345)
+        
+        assert result is True
+        assert "Одиночный владелец" in message
     
     @pytest.mark.asyncio
-    async def test_multisig_require_confirmation(self):
+    async def test_multisig_require_confirmation(self, bot_smart_module, monkeypatch, pending):
         """Тест требования мультиподписи"""
-        with patch('bot.OWNERS', {12345, 67890}), \
-             patch('bot.MULTISIG_THRESHOLD', 2), \
-             patch('bot.save_db') as mock_save:
-            
-            result, message = await require_multisig("test_action", "target", 12345)
-            
-            assert result is False
-            assert "2 подтверждений" in message
-            assert "Получено: 1/2" in message
-            mock_save.assert_called_once()
+        mock_save = AsyncMock()
+        monkeypatch.setattr(bot_smart_module, "MULTISIG_THRESHOLD", 2)
+        monkeypatch.setattr(bot_smart_module, "save_db", mock_save)
+        
+        result, message = await bot_smart_module.require_multisig("test_action", "target", 12345)
+        
+        assert result is False
+        assert "2 подтверждений" in message
+        assert "Получено: 1/2" in message
+        assert len(pending) == 1
+        mock_save.assert_called_once()
     
     @pytest.mark.asyncio
-    async def test_multisig_confirmation(self):
+    async def test_multisig_confirmation(self, bot_smart_module, monkeypatch, pending):
         """Тест подтверждения мультиподписи"""
         action_id = "test_action:target:1234567890"
+        pending[action_id] = {
+            "type": "test_action",
+            "target": "target",
+            "initiator": 12345,
+            "confirmations": {12345},
+            "required": 2,
+            "ts": _FIXED_TS
+        }
         
-        with patch('bot.MULTISIG_THRESHOLD', 2), \
-             patch('bot.save_db') as mock_save:
-            
-            _pending_actions[action_id] = {
-                "type": "test_action",
-                "target": "target",
-                "initiator": 12345,
-                "confirmations": {12345},
-                "required": 2,
-                "ts": asyncio.get_event_loop().time()
-            }
-            
-            result, message = await confirm_action(action_id, 67890)
-            
-            assert result is True
-            assert "Действие подтверждено" in message
-            assert action_id not in _pending_actions
-            mock_save.assert_called_once()
+        mock_save = AsyncMock()
+        monkeypatch.setattr(bot_smart_module, "save_db", mock_save)
+        
+        result, message = await bot_smart_module.confirm_action(action_id, 67890)
+        
+        assert result is True
+        assert "Действие подтверждено" in message
+        assert action_id not in pending
+        mock_save.assert_called_once()
+
+
+# Готовое дерево моков Gemini: клиент -> models.generate_content -> ответ
+_FAKE_GENAI_RESPONSE = MagicMock(text="Professional security analysis report")
+_FAKE_GENAI_CLIENT = MagicMock()
+_FAKE_GENAI_CLIENT.models.generate_content.return_value = _FAKE_GENAI_RESPONSE
+
+
+@pytest.fixture(scope="session")
+def agent_bot():
+    """agent_bot тянет google.genai — импортируем только для AI-тестов"""
+    return pytest.importorskip("agent_bot", reason="agent_bot/google-genai недоступны")
 
 
 class TestAIAnalysis:
     """Тесты AI-анализа"""
     
-    def test_ai_analysis_no_key(self):
+    def test_ai_analysis_no_key(self, agent_bot):
         """Тест AI-анализа без API ключа"""
         with patch.dict(os.environ, {'GEMINI_API_KEY': ''}):
-            result = analyze_event_ai("high", 5)
+            result = agent_bot.analyze_event_ai("high", 5)
             
             assert "AI analysis skipped" in result
     
-    def test_ai_analysis_success(self):
+    def test_ai_analysis_success(self, agent_bot):
         """Тест успешного AI-анализа"""
-        mock_response = MagicMock()
-        mock_response.text = "Professional security analysis report"
-        
+        pytest.importorskip("google.genai", reason="google-genai не установлен")
         with patch.dict(os.environ, {'GEMINI_API_KEY': 'test_key'}), \
-             patch('agent_bot.genai.Client') as mock_client, \
-             patch('agent_bot.genai.Client.models.generate_content', return_value=mock_response):
+             patch('google.genai.Client', return_value=_FAKE_GENAI_CLIENT):
             
-            result = analyze_event_ai("medium", 3)
+            result = agent_bot.analyze_event_ai("medium", 3)
             
             assert "Professional security analysis report" in result
 
@@ -286,45 +552,61 @@ class TestSecurityValidation:
     
     def test_is_owner_validation(self):
         """Тест проверки владельца"""
-        with patch('bot.OWNERS', {12345, 67890}):
-            assert is_owner(12345) is True
-            assert is_owner(99999) is False
+        assert is_owner(12345) is True
+        assert is_owner(99999) is False
+    
+    @pytest.mark.parametrize("text, expected", [
+        ("$5,000", 5000.0),
+        (" 12.5\n", 12.5),
+        ("1 000", None),  # пробел внутри числа — не сумма
+    ])
+    def test_parse_amount(self, bot_module, text, expected):
+        """Тест разбора суммы лимита"""
+        if expected is None:
+            with pytest.raises(ValueError):
+                bot_module.parse_amount(text)
+        else:
+            assert bot_module.parse_amount(text) == expected
     
     def test_web3_address_validation(self):
         """Тест валидации адресов Web3"""
-        valid_addr = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
+        from web3 import Web3
+
+        valid_addr = ADDR_CS
         invalid_addr = "invalid_address"
         
         assert Web3.is_address(valid_addr) is True
         assert Web3.is_address(invalid_addr) is False
 
 
+@pytest.fixture
+def price_caches(bot_module):
+    """Кэши цен bot меняются на месте: ссылки на dict остаются прежними, после теста — откат"""
+    caches = {
+        "_price_cache": bot_module._price_cache,
+        "_token_price_cache": bot_module._token_price_cache,
+    }
+    saved = {attr: dict(cache) for attr, cache in caches.items()}
+    yield caches
+    for attr, cache in caches.items():
+        cache.clear()
+        cache.update(saved[attr])
+
+
 class TestPriceCalculations:
     """Тесты расчета цен"""
-    
-    @pytest.mark.asyncio
-    async def test_bnb_to_usd_conversion(self):
-        """Тест конвертации BNB в USD"""
-        with patch('bot.refresh_bnb_price') as mock_refresh, \
-             patch('bot._price_cache', {'BNB': 600.0}):
-            
-            mock_refresh.return_value = None
-            
-            result = await bnb_to_usd(1.5)
-            
-            assert result == 900.0
-    
+
     @pytest.mark.asyncio
-    async def test_token_to_usd_conversion(self):
-        """Тест конвертации токенов в USD"""
-        token_addr = "0x742d35Cc6634C0532925a3b8D4C9db96C4b4Db45"
-        raw_amount = 1000000000000000000000  # 1000 токенов с 18 decimals
-        decimals = 18
-        
-        with patch('bot._token_price_cache', {token_addr: (0.5, asyncio.get_event_loop().time())}):
-            result = await token_to_usd(token_addr, raw_amount, decimals)
-            
-            assert result == 500.0  # 1000 * $0.5
+    @pytest.mark.parametrize("convert, cache_attr, entries, args, expected", [
+        (bnb_to_usd, '_price_cache', {'BNB': 600.0}, (1.5,), 900.0),
+        # 1000 токенов с 18 decimals по $0.5
+        (token_to_usd, '_token_price_cache', {ADDR_CS: (0.5, _FIXED_TS)},
+         (ADDR_CS, 10**21, 18), 500.0),
+    ], ids=["bnb", "token"])
+    async def test_usd_conversion(self, price_caches, convert, cache_attr, entries, args, expected):
+        """Тест конвертации BNB и токенов в USD"""
+        price_caches[cache_attr].update(entries)
+        assert await convert(*args) == expected
 
 
 if __name__ == "__main__":